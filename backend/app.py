@@ -1,44 +1,224 @@
 import os
 import json
 import concurrent.futures
-from flask import Flask, request, jsonify, send_from_directory
+import contextvars
+from flask import Blueprint, Flask, g, request, jsonify, send_from_directory
 from flask_cors import CORS
-from groq import Groq
-from dotenv import load_dotenv
-from datetime import datetime, timedelta
+from werkzeug.middleware.proxy_fix import ProxyFix
+from datetime import datetime, timedelta, timezone
 from personas import PERSONAS, get_persona_list
-import gc
+from upstreams import build_pool_from_env
+from response_cache import ResponseCache, normalize_question
+from scheduler import SchedulerOverloaded, build_request_limiter_from_env, build_scheduler_from_env
+import atexit
+import hashlib
+import hmac
+import signal
 import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 
 
-load_dotenv()
+# All routes live on this blueprint; create_app() attaches it to a Flask app.
+council_bp = Blueprint("council", __name__)
 
 
-app = Flask(__name__)
-CORS(app, resources={
-    r"/*": {
-        "origins": ["https://depth-chi.vercel.app", "https://depth-qiu9wulnc-jins-projects-ee877f80.vercel.app", "*"],
-        "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type"]
-    }
-})
+# Upstream pool is built lazily on first use (see get_upstream_pool)
+_upstream_pool = None
+_upstream_pool_lock = threading.Lock()
+
+
+# Response cache is also built lazily (see get_response_cache)
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
 
+# Shared thread pool for parallel LLM calls (see get_llm_executor)
+_llm_executor = None
+_llm_executor_lock = threading.Lock()
 
-# Initialize API client
-groq_api_key = os.getenv("GROQ_API_KEY")
-groq_client = Groq(api_key=groq_api_key)
 
+# Fair scheduler in front of upstream calls (see get_scheduler)
+_scheduler = None
+_scheduler_lock = threading.Lock()
+_request_limiter = None
+_request_limiter_lock = threading.Lock()
 
-# Token tracking (simple in-memory)
+# (client id, priority class) of the work currently running. Set per request
+# and copied into executor threads so every upstream call is queued fairly.
+upstream_ticket = contextvars.ContextVar("upstream_ticket", default=("internal", "interactive"))
+
+# Per-task token counter (see metered_tokens); follows work into executor threads
+token_meter = contextvars.ContextVar("token_meter", default=None)
+
+
+# Token tracking (simple in-memory, rolls over at the daily reset)
 token_usage = {
     "used": 0,
     "limit": 100000,
     "reset_time": None
 }
+_token_usage_lock = threading.Lock()
+
+
+def get_upstream_pool():
+    """
+    Return the shared pool of upstream backends (Groq keys and
+    OpenAI-compatible endpoints), constructing it on first use.
+    
+    The groq SDK pulls in httpx and pydantic, so importing it is the
+    slowest part of startup. Deferring it also means the clients (and their
+    connection pools) are created inside each gunicorn worker after fork
+    instead of being inherited from the preloaded master.
+    """
+    global _upstream_pool
+    if _upstream_pool is None:
+        with _upstream_pool_lock:
+            if _upstream_pool is None:
+                _upstream_pool = build_pool_from_env()
+    return _upstream_pool
 
 
-# Roast Council initialized
-print(f"[INIT] Roast Council loaded: {len(PERSONAS)} personas ready")
+def get_llm_executor():
+    """
+    Return the worker's shared thread pool for parallel upstream calls,
+    creating it on first use (after fork). Sized by LLM_EXECUTOR_WORKERS.
+    
+    Kept well above UPSTREAM_CONCURRENCY: threads mostly sit waiting for a
+    scheduler slot, and the executor's own FIFO queue must not become the
+    bottleneck or it would bypass fair ordering.
+    """
+    global _llm_executor
+    if _llm_executor is None:
+        with _llm_executor_lock:
+            if _llm_executor is None:
+                _llm_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=_env_int("LLM_EXECUTOR_WORKERS", 32),
+                    thread_name_prefix="llm"
+                )
+    return _llm_executor
+
+
+def submit_llm_task(fn, *args):
+    """Submit to the shared executor, carrying the caller's upstream_ticket"""
+    return get_llm_executor().submit(contextvars.copy_context().run, fn, *args)
+
+
+def get_scheduler():
+    """Return the worker's upstream fair scheduler, creating it on first use"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = build_scheduler_from_env()
+    return _scheduler
+
+
+def get_request_limiter():
+    """Return the worker's per-class request limiter, creating it on first use"""
+    global _request_limiter
+    if _request_limiter is None:
+        with _request_limiter_lock:
+            if _request_limiter is None:
+                _request_limiter = build_request_limiter_from_env()
+    return _request_limiter
+
+
+def get_response_cache():
+    """Return the shared response cache, opening it on first use"""
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache()
+                print(f"[INIT] Response cache: {_response_cache.path}")
+    return _response_cache
+
+
+def next_token_reset(now):
+    """
+    Next daily token reset after `now` (UTC). TOKEN_RESET_UTC is "HH:MM";
+    the default 00:00 UTC is the 5:30 AM IST reset from TOMORROW.md.
+    """
+    try:
+        hour, minute = (int(x) for x in os.getenv("TOKEN_RESET_UTC", "00:00").split(":"))
+    except ValueError:
+        hour, minute = 0, 0
+    reset = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if reset <= now:
+        reset += timedelta(days=1)
+    return reset
+
+
+def _roll_token_usage():
+    # Caller holds _token_usage_lock
+    now = datetime.now(timezone.utc)
+    if token_usage["reset_time"] is None:
+        token_usage["reset_time"] = next_token_reset(now)
+    elif now >= token_usage["reset_time"]:
+        print(f"[TOKENS] Daily reset ({token_usage['used']} used yesterday)")
+        token_usage["used"] = 0
+        token_usage["reset_time"] = next_token_reset(now)
+
+
+def record_tokens(count):
+    """
+    Add to today's token count (and to the active token meter, if any).
+    Also added to the shared store, since token_usage only sees this worker.
+    """
+    meter = token_meter.get()
+    with _token_usage_lock:
+        _roll_token_usage()
+        token_usage["used"] += count
+        period = token_usage["reset_time"].isoformat()
+        if meter is not None:
+            meter["tokens"] += count
+    try:
+        get_response_cache().add_tokens(period, count)
+    except Exception as e:
+        print(f"[TOKENS] ⚠ Shared usage update failed: {e}")
+
+
+@contextmanager
+def metered_tokens():
+    """
+    Count exactly the tokens spent by the enclosed work, including calls it
+    fans out to the shared executor, regardless of concurrent traffic.
+    
+        with metered_tokens() as meter:
+            run_council_pipeline(question)
+        cost = meter["tokens"]
+    """
+    meter = {"tokens": 0}
+    reset = token_meter.set(meter)
+    try:
+        yield meter
+    finally:
+        token_meter.reset(reset)
+
+
+def tokens_remaining():
+    """Tokens left in today's budget"""
+    with _token_usage_lock:
+        _roll_token_usage()
+        return max(0, token_usage["limit"] - token_usage["used"])
+
+
+def shared_tokens_remaining():
+    """
+    Tokens left in today's budget across every worker on the host. Falls
+    back to this worker's count if the shared store can't be read.
+    """
+    with _token_usage_lock:
+        _roll_token_usage()
+        period = token_usage["reset_time"].isoformat()
+        used, limit = token_usage["used"], token_usage["limit"]
+    try:
+        used = max(used, get_response_cache().tokens_used(period))
+    except Exception as e:
+        print(f"[TOKENS] ⚠ Shared usage lookup failed: {e}")
+    return max(0, limit - used)
 
 
 # =============================================================================
@@ -114,13 +294,217 @@ NO FLUFF. Be specific. Start with "The Council has reached a difficult consensus
 Maximum 150 words."""
 
 
+# Map council persona keys to PersonaManager names.
+# Note: We're mapping the 4 council members to the 4 available knowledge bases.
+# Built once at import so preloaded gunicorn workers share it copy-on-write.
+COUNCIL_PERSONA_MAPPING = {
+    "marcus": "MARCUS",      # Risk Officer (Taleb) - fits Marcus perfectly
+    "alex": "ALEX",          # Strategist (Thiel/Helmer) - fits Alex perfectly
+    "jung": "MAYA",          # Customer Researcher (Mom Test) - Jung asks questions about users
+    "siddhartha": "TURING"   # Engineer (Brooks) - Siddhartha simplifies/removes complexity
+}
+
+COUNCIL_PERSONA_NAMES = {
+    "marcus": "Marcus",
+    "alex": "Alex",
+    "jung": "Maya",
+    "siddhartha": "Turing"
+}
+
+
+# =============================================================================
+# ADAPTIVE FAN-OUT POLICY
+# =============================================================================
+# Stage 3 used to call all 4 personas with max_tokens=1000 for every question.
+# The routing stage already scores urgency (1-10), so use it (plus a cheap
+# question-complexity check and current load) to pick how many personas
+# speak and how long they may talk.
+#
+# Config (env, read per request so it can be changed without a redeploy):
+#   FANOUT_POLICY          adaptive | full            (default adaptive)
+#   FANOUT_TIERS           JSON overriding FANOUT_TIERS below
+#   FANOUT_HIGH_URGENCY    urgency >= this -> full     (default 7)
+#   FANOUT_LOW_URGENCY     urgency <= this -> lite     (default 3)
+#   FANOUT_TRIVIAL_WORDS   fewer words -> one tier down (default 6)
+#   FANOUT_LOAD_ACTIVE     other concurrent pipelines that count as load (default 2)
+#   FANOUT_LOAD_PER_MIN    other pipelines/minute that count as load (default 6)
+#   FANOUT_BUDGET_PERCENT  host-wide daily token use that counts as load (default 80)
+
+
+FANOUT_TIER_ORDER = ["lite", "standard", "full"]
+
+FANOUT_TIERS = {
+    "lite":     {"personas": 2, "max_tokens": 350},
+    "standard": {"personas": 3, "max_tokens": 600},
+    "full":     {"personas": 4, "max_tokens": 1000}
+}
+
+DEFAULT_SPEAKING_ORDER = ["marcus", "jung", "alex", "siddhartha"]
+
+
+# Pipeline load tracking (per worker process)
+pipeline_load = {
+    "active": 0,
+    "recent_starts": deque(maxlen=100)
+}
+_pipeline_load_lock = threading.Lock()
+
+
+def _env_int(name, default):
+    """Read an integer env var, falling back to default on missing/bad values"""
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def get_fanout_tiers():
+    """FANOUT_TIERS, optionally overridden by the FANOUT_TIERS env var (JSON)"""
+    override = os.getenv("FANOUT_TIERS")
+    if not override:
+        return FANOUT_TIERS
+    try:
+        tiers = {name: dict(cfg) for name, cfg in FANOUT_TIERS.items()}
+        for name, cfg in json.loads(override).items():
+            if name in tiers:
+                tiers[name].update(cfg)
+        for name, cfg in tiers.items():
+            for field, minimum in (("personas", 1), ("max_tokens", 1)):
+                value = cfg[field]
+                if not isinstance(value, int) or isinstance(value, bool) or value < minimum:
+                    raise ValueError(f"{name}.{field} must be an integer >= {minimum}, got {value!r}")
+        return tiers
+    except (json.JSONDecodeError, AttributeError, TypeError, ValueError) as e:
+        print(f"[FANOUT] ⚠ Ignoring invalid FANOUT_TIERS: {e}")
+        return FANOUT_TIERS
+
+
+def pipeline_started():
+    """Count a pipeline as running; returns its start time for current_load()"""
+    started_at = time.monotonic()
+    with _pipeline_load_lock:
+        pipeline_load["active"] += 1
+        pipeline_load["recent_starts"].append(started_at)
+    return started_at
+
+
+def pipeline_finished():
+    with _pipeline_load_lock:
+        pipeline_load["active"] = max(0, pipeline_load["active"] - 1)
+
+
+def current_load(own_start=None):
+    """
+    Snapshot of this worker's pipeline load and the host's daily token use.
+    Pass the caller's pipeline_started() time as `own_start` so a pipeline
+    doesn't count itself as load.
+    """
+    cutoff = time.monotonic() - 60
+    with _pipeline_load_lock:
+        active = pipeline_load["active"]
+        per_minute = sum(1 for t in pipeline_load["recent_starts"] if t >= cutoff)
+    if own_start is not None:
+        active -= 1
+        per_minute -= 1 if own_start >= cutoff else 0
+    limit = token_usage["limit"]
+    budget_percent = int((limit - shared_tokens_remaining()) / limit * 100) if limit > 0 else 0
+    return {"active": max(0, active), "per_minute": max(0, per_minute), "budget_percent": budget_percent}
+
+
+def normalize_speaking_order(routing_json):
+    """
+    Clean up the routing stage's speaking order.
+    
+    The model sometimes echoes placeholders ("first", "second") or drops
+    members, so keep only known personas, put first_speaker up front and
+    append anyone missing in the default order.
+    """
+    order = []
+    first = routing_json.get("first_speaker")
+    candidates = [first] + list(routing_json.get("speaking_order") or []) + DEFAULT_SPEAKING_ORDER
+    for key in candidates:
+        if isinstance(key, str):
+            key = key.strip().lower()
+        if key in COUNCIL_PERSONA_NAMES and key not in order:
+            order.append(key)
+    return order
+
+
+def choose_fanout(question, routing_json, own_start=None):
+    """
+    Decide which personas speak in Stage 3 and their output budget.
+    `own_start` is the calling pipeline's pipeline_started() time.
+    
+    Returns a dict that is also reported to the client:
+        {"policy", "tier", "personas", "max_tokens", "urgency", "reasons",
+         "under_load", "load"}
+    """
+    tiers = get_fanout_tiers()
+    policy = os.getenv("FANOUT_POLICY", "adaptive").lower()
+    speaking_order = normalize_speaking_order(routing_json)
+    load = current_load(own_start)
+    reasons = []
+    under_load = False
+    
+    try:
+        urgency = max(1, min(10, int(routing_json.get("urgency", 5))))
+    except (TypeError, ValueError):
+        urgency = 5
+    
+    if policy == "full":
+        tier = "full"
+        reasons.append("policy=full")
+    else:
+        if urgency >= _env_int("FANOUT_HIGH_URGENCY", 7):
+            tier = "full"
+            reasons.append(f"high urgency ({urgency})")
+        elif urgency <= _env_int("FANOUT_LOW_URGENCY", 3):
+            tier = "lite"
+            reasons.append(f"low urgency ({urgency})")
+        else:
+            tier = "standard"
+            reasons.append(f"moderate urgency ({urgency})")
+        
+        level = FANOUT_TIER_ORDER.index(tier)
+        
+        # Trivial questions don't need the full council (but a crisis does)
+        if tier != "full" and len(question.split()) < _env_int("FANOUT_TRIVIAL_WORDS", 6):
+            level -= 1
+            reasons.append("trivial question")
+        
+        # Under load, tighten one tier to cut upstream calls and tokens
+        under_load = (
+            load["active"] >= _env_int("FANOUT_LOAD_ACTIVE", 2)
+            or load["per_minute"] >= _env_int("FANOUT_LOAD_PER_MIN", 6)
+            or load["budget_percent"] >= _env_int("FANOUT_BUDGET_PERCENT", 80)
+        )
+        if under_load:
+            level -= 1
+            reasons.append("under load")
+        
+        tier = FANOUT_TIER_ORDER[max(0, level)]
+    
+    config = tiers[tier]
+    count = max(1, min(int(config["personas"]), len(speaking_order)))
+    
+    return {
+        "policy": policy,
+        "tier": tier,
+        "personas": speaking_order[:count],
+        "max_tokens": int(config["max_tokens"]),
+        "urgency": urgency,
+        "reasons": reasons,
+        "under_load": under_load,
+        "load": load
+    }
+
 
 # =============================================================================
 # BRAIN ROUTER - MODEL SELECTION FACTORY
 # =============================================================================
 
 
-def get_model_response(task_type, prompt, require_json=False):
+def get_model_response(task_type, prompt, require_json=False, max_tokens=1000):
     """
     Brain Router: Routes ALL tasks to Groq (Llama 3.3 70B).
     Temperature varies by task type for optimal performance.
@@ -131,37 +515,32 @@ def get_model_response(task_type, prompt, require_json=False):
     creative_tasks = ['analysis', 'synthesis', 'jung', 'siddhartha']
     temperature = 0.9 if task_type in creative_tasks else 0.6
     
-    return call_groq(prompt, require_json=require_json, temperature=temperature)
+    return call_groq(prompt, require_json=require_json, temperature=temperature, max_tokens=max_tokens)
 
 
 
-def call_groq(prompt, require_json=False, temperature=0.7):
-    """Call Groq API with Llama 3.3 70B"""
+def call_groq(prompt, require_json=False, temperature=0.7, max_tokens=1000):
+    """Call Llama 3.3 70B on the least-loaded upstream backend"""
     global token_usage
     
     try:
         print(f"[GROQ] Calling API with temperature={temperature}, require_json={require_json}")
         
-        kwargs = {
-            "model": "llama-3.3-70b-versatile",
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": temperature,
-            "max_tokens": 1000,
-            "timeout": 10.0  # Fix #3: 10 second timeout to prevent long waits
-        }
-        
-        if require_json:
-            kwargs["response_format"] = {"type": "json_object"}
-        
-        completion = groq_client.chat.completions.create(**kwargs)
+        with get_scheduler().slot(*upstream_ticket.get()):
+            response, tokens, backend_name = get_upstream_pool().complete(
+                messages=[{"role": "user", "content": prompt}],
+                temperature=temperature,
+                max_tokens=max_tokens,
+                timeout=10.0,  # Fix #3: 10 second timeout to prevent long waits
+                require_json=require_json
+            )
         
         # Track tokens
-        if hasattr(completion, 'usage') and completion.usage:
-            token_usage["used"] += completion.usage.total_tokens
-            print(f"[GROQ] Tokens used: {completion.usage.total_tokens}, Total: {token_usage['used']}")
+        if tokens:
+            record_tokens(tokens)
+            print(f"[GROQ] Tokens used: {tokens}, Total: {token_usage['used']}")
         
-        response = completion.choices[0].message.content.strip()
-        print(f"[GROQ] Response received ({len(response)} chars)")
+        print(f"[GROQ] Response received from {backend_name} ({len(response)} chars)")
         
         return response
         
@@ -181,13 +560,71 @@ def call_groq(prompt, require_json=False, temperature=0.7):
 # =============================================================================
 
 
-def run_council_pipeline(question):
+def generate_psychological_brief(question):
     """
-    Execute the 4-stage Hybrid Cognitive Pipeline.
+    Stage 1: diagnose the hidden fear behind the question.
+    
+    Returns (brief_json, parsed); parsed is False when the model's output
+    could not be parsed and a generic fallback brief is returned instead.
+    """
+    print("\n[STAGE 1] Starting Psychological Brief...")
+    brief_prompt = PSYCHOLOGICAL_BRIEF_PROMPT.format(question=question)
+    brief_response = get_model_response('analysis', brief_prompt)
+    
+    # Parse JSON from response
+    try:
+        # Clean up response if it has markdown code blocks
+        clean_brief = brief_response.strip()
+        if clean_brief.startswith('```'):
+            clean_brief = clean_brief.split('```')[1]
+            if clean_brief.startswith('json'):
+                clean_brief = clean_brief[4:]
+        brief_json = json.loads(clean_brief.strip())
+        print(f"[STAGE 1] ✓ Brief parsed: {brief_json.get('hidden_fear', 'N/A')}")
+        return brief_json, True
+    except json.JSONDecodeError as e:
+        print(f"[STAGE 1] ⚠ JSON parse failed: {e}")
+        return {
+            "surface_question": question,
+            "hidden_fear": "Unable to parse - proceeding with surface question",
+            "emotional_tone": "uncertain",
+            "needs": "clarity"
+        }, False
+
+
+def generate_debate_parameters(brief_json):
+    """
+    Stage 2: structure the debate from the brief.
+    
+    Returns (routing_json, parsed), with a default routing when parsing fails.
+    """
+    print("\n[STAGE 2] Starting Debate Parameters...")
+    routing_prompt = ROUTING_PROMPT.format(brief=json.dumps(brief_json))
+    routing_response = get_model_response('routing', routing_prompt, require_json=True)
+    
+    try:
+        routing_json = json.loads(routing_response.strip())
+        print(f"[STAGE 2] ✓ Routing parsed: {routing_json.get('speaking_order', [])}")
+        return routing_json, True
+    except json.JSONDecodeError as e:
+        print(f"[STAGE 2] ⚠ JSON parse failed: {e}")
+        return {
+            "first_speaker": "marcus",
+            "urgency": 5,
+            "debate_angle": "Action vs Reflection",
+            "speaking_order": ["marcus", "jung", "alex", "siddhartha"]
+        }, False
+
+
+
+def run_council_pipeline(question, client=None):
+    """
+    Execute the 4-stage Hybrid Cognitive Pipeline. `client` (client_identity)
+    lets Stages 1-2 reuse that client's speculative prefetch.
     
     Stage 1 (Gemini): Psychological Brief - diagnose hidden fear
     Stage 2 (Groq): Debate Parameters - structure the debate
-    Stage 3 (Hybrid): Parallel persona generation
+    Stage 3 (Hybrid): Parallel persona generation (sized by choose_fanout)
     Stage 4 (Gemini): Synthesis - the peace treaty
     """
     print("\n" + "="*60)
@@ -199,82 +636,60 @@ def run_council_pipeline(question):
         "psychological_brief": None,
         "debate_parameters": None,
         "debate": [],
-        "synthesis": None
+        "fanout": None,
+        "speculation": None,
+        "synthesis": None,
+        # Degradation markers, so callers know whether the result is cacheable
+        "brief_parsed": False,
+        "routing_parsed": False,
+        "fallbacks": 0
     }
     
+    started_at = pipeline_started()
     try:
+        # Reuse a brief (and routing) prefetched while the user was typing
+        speculative, speculation_report = find_speculative_stages(question, client)
+        pipeline_result["speculation"] = speculation_report
+        
         # =====================================================================
         # STAGE 1: PSYCHOLOGICAL BRIEF (Gemini - Analysis)
         # =====================================================================
-        print("\n[STAGE 1] Starting Psychological Brief...")
-        brief_prompt = PSYCHOLOGICAL_BRIEF_PROMPT.format(question=question)
-        brief_response = get_model_response('analysis', brief_prompt)
-        
-        # Parse JSON from response
-        try:
-            # Clean up response if it has markdown code blocks
-            clean_brief = brief_response.strip()
-            if clean_brief.startswith('```'):
-                clean_brief = clean_brief.split('```')[1]
-                if clean_brief.startswith('json'):
-                    clean_brief = clean_brief[4:]
-            brief_json = json.loads(clean_brief.strip())
-            print(f"[STAGE 1] ✓ Brief parsed: {brief_json.get('hidden_fear', 'N/A')}")
-        except json.JSONDecodeError as e:
-            print(f"[STAGE 1] ⚠ JSON parse failed: {e}")
-            brief_json = {
-                "surface_question": question,
-                "hidden_fear": "Unable to parse - proceeding with surface question",
-                "emotional_tone": "uncertain",
-                "needs": "clarity"
-            }
+        if speculative and speculative.get("brief"):
+            # Only parsed briefs are ever stored as speculative
+            brief_json, brief_parsed = speculative["brief"], True
+            print(f"[STAGE 1] ✓ Reused speculative brief (+{speculation_report['extra_words']} words since draft)")
+        else:
+            brief_json, brief_parsed = generate_psychological_brief(question)
         
         pipeline_result["psychological_brief"] = brief_json
+        pipeline_result["brief_parsed"] = brief_parsed
         pipeline_result["stages_completed"].append("psychological_brief")
         
         # =====================================================================
         # STAGE 2: DEBATE PARAMETERS (Groq - Routing)
         # =====================================================================
-        print("\n[STAGE 2] Starting Debate Parameters...")
-        routing_prompt = ROUTING_PROMPT.format(brief=json.dumps(brief_json))
-        routing_response = get_model_response('routing', routing_prompt, require_json=True)
-        
-        try:
-            routing_json = json.loads(routing_response.strip())
-            print(f"[STAGE 2] ✓ Routing parsed: {routing_json.get('speaking_order', [])}")
-        except json.JSONDecodeError as e:
-            print(f"[STAGE 2] ⚠ JSON parse failed: {e}")
-            routing_json = {
-                "first_speaker": "marcus",
-                "urgency": 5,
-                "debate_angle": "Action vs Reflection",
-                "speaking_order": ["marcus", "jung", "alex", "siddhartha"]
-            }
+        if speculative and speculative.get("brief") and speculative.get("routing"):
+            routing_json, routing_parsed = speculative["routing"], True
+            print("[STAGE 2] ✓ Reused speculative routing")
+        else:
+            routing_json, routing_parsed = generate_debate_parameters(brief_json)
         
         pipeline_result["debate_parameters"] = routing_json
+        pipeline_result["routing_parsed"] = routing_parsed
         pipeline_result["stages_completed"].append("debate_parameters")
         
         # =====================================================================
         # STAGE 3: PARALLEL PERSONA GENERATION (Hybrid)
         # =====================================================================
         print("\n[STAGE 3] Starting Parallel Persona Generation...")
-        speaking_order = routing_json.get("speaking_order", ["marcus", "jung", "alex", "siddhartha"])
-        
-        # Map persona keys to PersonaManager names
-        # Note: We're mapping the 4 council members to the 4 available knowledge bases
-        persona_mapping = {
-            "marcus": "MARCUS",      # Risk Officer (Taleb) - fits Marcus perfectly
-            "alex": "ALEX",          # Strategist (Thiel/Helmer) - fits Alex perfectly
-            "jung": "MAYA",          # Customer Researcher (Mom Test) - Jung asks questions about users
-            "siddhartha": "TURING"   # Engineer (Brooks) - Siddhartha simplifies/removes complexity
-        }
+        fanout = choose_fanout(question, routing_json, started_at)
+        speaking_order = fanout["personas"]
+        pipeline_result["fanout"] = fanout
+        print(f"[STAGE 3] Fan-out: tier={fanout['tier']} personas={speaking_order} "
+              f"max_tokens={fanout['max_tokens']} ({', '.join(fanout['reasons'])})")
         
-        persona_names = {
-            "marcus": "Marcus",
-            "alex": "Alex", 
-            "jung": "Maya",
-            "siddhartha": "Turing"
-        }
+        persona_mapping = COUNCIL_PERSONA_MAPPING
+        persona_names = COUNCIL_PERSONA_NAMES
         
         context = f"""The user asks: "{question}"
 
@@ -287,7 +702,7 @@ Give YOUR perspective. Be distinct. Be sharp."""
         
         debate_messages = []
         
-        # Generate responses in parallel using ThreadPoolExecutor
+        # Generate responses in parallel on the shared executor
         def generate_persona_response(persona_key):
             print(f"[STAGE 3] Generating response for {persona_names[persona_key]}...")
             # Get knowledge-rich system prompt from PersonaManager
@@ -306,7 +721,7 @@ Give YOUR perspective. Be distinct. Be sharp."""
             
             # Combine system prompt with context
             full_prompt = f"{system_prompt}\n\n{context}"
-            response = get_model_response(persona_key, full_prompt)
+            response = get_model_response(persona_key, full_prompt, max_tokens=fanout["max_tokens"])
             
             # Fix #2: Truncate long responses
             MAX_RESPONSE_LENGTH = 2000
@@ -322,22 +737,24 @@ Give YOUR perspective. Be distinct. Be sharp."""
                 "message": response
             }
         
-        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-            futures = {executor.submit(generate_persona_response, p): p for p in speaking_order}
-            results = {}
-            for future in concurrent.futures.as_completed(futures):
-                persona = futures[future]
-                try:
-                    results[persona] = future.result()
-                except Exception as e:
-                    print(f"[STAGE 3] ERROR for {persona}: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    results[persona] = {
-                        "speaker": persona_names[persona],
-                        "persona_id": persona,
-                        "message": f"[{persona_names[persona]} is contemplating...]"
-                    }
+        futures = {submit_llm_task(generate_persona_response, p): p for p in speaking_order}
+        results = {}
+        for future in concurrent.futures.as_completed(futures):
+            persona = futures[future]
+            try:
+                results[persona] = future.result()
+            except SchedulerOverloaded:
+                raise
+            except Exception as e:
+                print(f"[STAGE 3] ERROR for {persona}: {e}")
+                import traceback
+                traceback.print_exc()
+                pipeline_result["fallbacks"] += 1
+                results[persona] = {
+                    "speaker": persona_names[persona],
+                    "persona_id": persona,
+                    "message": f"[{persona_names[persona]} is contemplating...]"
+                }
         
         # Maintain speaking order
         for persona in speaking_order:
@@ -374,6 +791,10 @@ Give YOUR perspective. Be distinct. Be sharp."""
         print("="*60 + "\n")
         
         return pipeline_result
+    
+    except SchedulerOverloaded:
+        # Shed, not failed: let the endpoint answer 503 + Retry-After
+        raise
         
     except Exception as e:
         # Graceful failure with full error logging
@@ -387,6 +808,561 @@ Give YOUR perspective. Be distinct. Be sharp."""
         if not pipeline_result["synthesis"]:
             pipeline_result["synthesis"] = "The Council is meditating. Please try again in a moment."
         return pipeline_result
+    
+    finally:
+        pipeline_finished()
+
+
+
+def run_roast_council(question):
+    """
+    Ask every Roast Council persona in parallel.
+    
+    Returns (results, fallbacks): the per-persona response dicts and how
+    many of them are canned fallbacks because the upstream call failed.
+    Raises SchedulerOverloaded if the calls were shed by the scheduler.
+    """
+    # Parallel execution with fallback handling
+    results = {}
+    fallbacks = []
+    lock = threading.Lock()
+    
+    def call_persona(persona_id):
+        persona = PERSONAS[persona_id]
+        print(f"[{persona['name']}] Calling Groq...")
+        
+        try:
+            with get_scheduler().slot(*upstream_ticket.get()):
+                message, tokens, backend_name = get_upstream_pool().complete(
+                    messages=[
+                        {"role": "system", "content": persona["system_prompt"]},
+                        {"role": "user", "content": question}
+                    ],
+                    temperature=0.9,
+                    max_tokens=150,
+                    timeout=10.0
+                )
+            record_tokens(tokens)
+            print(f"[{persona['name']}] ✓ Response received from {backend_name} ({len(message)} chars)")
+        except SchedulerOverloaded:
+            raise
+        except Exception as e:
+            # Fallback on ANY error (rate limit, timeout, network, etc.)
+            print(f"[{persona['name']}] ✗ Error: {e}")
+            message = persona["fallback"]
+            with lock:
+                fallbacks.append(persona_id)
+        
+        with lock:
+            results[persona_id] = {
+                "id": persona_id,
+                "name": persona["name"],
+                "emoji": persona["emoji"],
+                "response": message
+            }
+    
+    # Execute all 4 personas in parallel
+    futures = [submit_llm_task(call_persona, pid) for pid in PERSONAS.keys()]
+    concurrent.futures.wait(futures, timeout=15)  # 15s max wait
+    
+    for future in futures:
+        if future.done() and isinstance(future.exception(), SchedulerOverloaded):
+            raise future.exception()
+    
+    with lock:
+        # Anyone still running after 15s counts as a fallback (not cached)
+        return list(results.values()), len(fallbacks) + len(PERSONAS) - len(results)
+
+
+
+# =============================================================================
+# FAIR SCHEDULING OF UPSTREAM CAPACITY
+# =============================================================================
+# Every upstream call waits for a slot in the worker's FairScheduler (see
+# scheduler.py), queued per client with weights per priority class. Cheap
+# interactive roasts outrank 7-call debates; the warm-up job runs as
+# "background". Overflow is shed with 503 + Retry-After.
+#
+# Config (env), besides the scheduler's own:
+#   SCHEDULER_ENDPOINT_CLASSES  JSON {endpoint: class} overriding the map below
+#   API_KEYS                    comma-separated client keys; only these are
+#                               honoured in X-API-Key
+#   TRUSTED_PROXY_HOPS          proxies in front of the app that append to
+#                               X-Forwarded-For (default 1; 0 if exposed directly)
+
+
+ENDPOINT_PRIORITY_CLASSES = {
+    "council.get_responses": "interactive",
+    "council.chat": "interactive",
+    "council.council_debate": "bulk",
+    "council.council_prefetch": "speculative"
+}
+
+
+def _known_api_key(api_key):
+    keys = [k.strip() for k in os.getenv("API_KEYS", "").split(",") if k.strip()]
+    return any(hmac.compare_digest(api_key.encode(), k.encode()) for k in keys)
+
+
+def client_identity():
+    """
+    Who to queue a request under: the X-API-Key if it is one of API_KEYS
+    (hashed, never stored raw), else the client address.
+    
+    Unknown keys are ignored, so a client can't mint fresh identities to
+    escape its own queue. The address is the socket peer as rewritten by
+    ProxyFix (see create_app) from the hop our own proxy appended, never
+    the spoofable first X-Forwarded-For entry.
+    """
+    api_key = request.headers.get("X-API-Key")
+    if api_key and _known_api_key(api_key):
+        return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:12]
+    return "ip:" + (request.remote_addr or "unknown")
+
+
+def endpoint_priority_class(endpoint):
+    override = os.getenv("SCHEDULER_ENDPOINT_CLASSES")
+    if override:
+        try:
+            mapped = json.loads(override).get(endpoint)
+            if mapped:
+                return mapped
+        except (json.JSONDecodeError, AttributeError) as e:
+            print(f"[SCHEDULER] ⚠ Ignoring invalid SCHEDULER_ENDPOINT_CLASSES: {e}")
+    return ENDPOINT_PRIORITY_CLASSES.get(endpoint)
+
+
+@council_bp.before_app_request
+def assign_upstream_ticket():
+    """
+    Tag the request's upstream calls and shed it early if its class is
+    full, either in the upstream queue or in HTTP threads held per class
+    and per client (see RequestLimiter).
+    """
+    priority_class = endpoint_priority_class(request.endpoint)
+    client = client_identity()
+    upstream_ticket.set((client, priority_class or "interactive"))
+    if priority_class:
+        get_scheduler().check_admission(client, priority_class)
+        g.request_slot = get_request_limiter().admit(client, priority_class)
+
+
+@council_bp.teardown_app_request
+def release_request_slot(exc):
+    get_request_limiter().release(g.pop("request_slot", None))
+
+
+@council_bp.app_errorhandler(SchedulerOverloaded)
+def handle_scheduler_overloaded(e):
+    print(f"[SCHEDULER] Shed {e.priority_class} request: {e}")
+    response = jsonify({
+        "error": "busy",
+        "message": "The Council is at capacity. Please retry shortly.",
+        "priority_class": e.priority_class,
+        "retry_after": e.retry_after
+    })
+    response.status_code = 503
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+
+
+# =============================================================================
+# RESPONSE CACHE & OFF-PEAK WARMING
+# =============================================================================
+# Finished /api/getResponses ("roast") and /council/debate ("debate") payloads
+# are cached per normalized question (see response_cache.py). Whatever token
+# budget is left shortly before the daily reset would be lost anyway, so a
+# warm-up job spends a share of it precomputing answers to the most popular
+# recent questions.
+#
+# Config (env):
+#   CACHE_WARM_ENABLED        1 = run the in-process scheduler (default 0)
+#   CACHE_WARM_WINDOW_HOURS   run within this many hours before reset (default 2)
+#   CACHE_WARM_MAX_RECENT     max questions in the last 5 min to count as
+#                             low traffic (default 2)
+#   CACHE_WARM_BUDGET_SHARE   share of remaining tokens to spend (default 0.5)
+#   CACHE_WARM_MAX_QUESTIONS  cap on entries warmed per run (default 20)
+#   CACHE_WARM_LOOKBACK_HOURS question log window to rank (default 72)
+#   CACHE_WARM_HALF_LIFE_HOURS recency half-life for ranking (default 24)
+#   ADMIN_TOKEN               enables POST /cache/warm (X-Admin-Token header)
+
+
+# Used to budget kinds that have no cached cost sample yet
+WARM_DEFAULT_COST = {
+    "roast": 800,
+    "debate": 6000
+}
+
+# A warm-up holds the shared "cache_warmup" lock at most this long, in case
+# its worker dies mid-run
+WARM_LOCK_TTL = 3600
+
+warm_state = {
+    "scheduler_started": False
+}
+_warm_scheduler_lock = threading.Lock()
+
+
+def cache_lookup(kind, question):
+    try:
+        return get_response_cache().get(kind, question)
+    except Exception as e:
+        print(f"[CACHE] ⚠ Lookup failed: {e}")
+        return None
+
+
+def cache_store(kind, question, payload, cost_tokens, source="live"):
+    try:
+        get_response_cache().put(kind, question, payload, cost_tokens=max(0, cost_tokens), source=source)
+    except Exception as e:
+        print(f"[CACHE] ⚠ Store failed: {e}")
+
+
+def cache_log_question(kind, question):
+    try:
+        get_response_cache().log_question(kind, question)
+    except Exception as e:
+        print(f"[CACHE] ⚠ Question log failed: {e}")
+
+
+def warm_window_open():
+    """True shortly before the daily reset, and only while traffic is low"""
+    with _token_usage_lock:
+        _roll_token_usage()
+        reset_time = token_usage["reset_time"]
+    window = timedelta(hours=_env_int("CACHE_WARM_WINDOW_HOURS", 2))
+    if reset_time - datetime.now(timezone.utc) > window:
+        return False
+    return get_response_cache().recent_question_count(300) <= _env_int("CACHE_WARM_MAX_RECENT", 2)
+
+
+def run_cache_warmup(trigger="manual"):
+    """
+    Precompute popular questions into the response cache, spending at most
+    CACHE_WARM_BUDGET_SHARE of the tokens left today across all workers.
+    
+    Only one run at a time across all workers (a lock in the shared cache).
+    Cost per entry is metered exactly (metered_tokens). Returns the report,
+    or None if a run is in progress. The report is also saved to the shared
+    cache for GET /cache, without the question text.
+    """
+    cache = get_response_cache()
+    lock_owner = f"{os.getpid()}:{threading.get_ident()}:{time.time()}"
+    if not cache.acquire_lock("cache_warmup", lock_owner, WARM_LOCK_TTL):
+        print("[WARM] Skipped: a warm-up is already running")
+        return None
+    
+    # Lowest priority class: warm-up must never crowd out live users
+    upstream_ticket.set(("warmup", "background"))
+    
+    try:
+        try:
+            share = min(1.0, max(0.0, float(os.getenv("CACHE_WARM_BUDGET_SHARE", "0.5"))))
+        except ValueError:
+            share = 0.5
+        remaining = shared_tokens_remaining()
+        budget = int(remaining * share)
+        max_questions = _env_int("CACHE_WARM_MAX_QUESTIONS", 20)
+        candidates = cache.popular_questions(
+            lookback_seconds=_env_int("CACHE_WARM_LOOKBACK_HOURS", 72) * 3600,
+            half_life_seconds=_env_int("CACHE_WARM_HALF_LIFE_HOURS", 24) * 3600
+        )
+        
+        report = {
+            "trigger": trigger,
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "finished_at": None,
+            "tokens_remaining": remaining,
+            "budget": budget,
+            "spent": 0,
+            "candidates": len(candidates),
+            "already_cached": 0,
+            "skipped_over_budget": 0,
+            "warmed": [],
+            "failed": [],
+            "stopped_reason": "no more candidates"
+        }
+        print(f"[WARM] Starting ({trigger}): {len(candidates)} candidates, budget {budget}/{remaining} tokens")
+        
+        for item in candidates:
+            kind, question = item["kind"], item["question"]
+            if lifecycle["draining"]:
+                report["stopped_reason"] = "shutting down"
+                break
+            if len(report["warmed"]) >= max_questions:
+                report["stopped_reason"] = "max questions reached"
+                break
+            if cache.contains(kind, question):
+                report["already_cached"] += 1
+                continue
+            
+            estimate = cache.average_cost(kind) or WARM_DEFAULT_COST.get(kind, 6000)
+            if report["spent"] + estimate > budget:
+                # A cheaper kind further down may still fit
+                report["skipped_over_budget"] += 1
+                continue
+            
+            try:
+                with metered_tokens() as meter:
+                    if kind == "roast":
+                        results, fallbacks = run_roast_council(question)
+                        payload = {"results": results}
+                        ok = fallbacks == 0 and len(results) == len(PERSONAS)
+                    else:
+                        result = run_council_pipeline(question)
+                        payload = cacheable_debate(result, build_debate_response(result))
+                        ok = payload is not None
+            except SchedulerOverloaded:
+                report["stopped_reason"] = "upstream busy with live traffic"
+                break
+            cost = meter["tokens"]
+            report["spent"] += cost
+            
+            entry = {"kind": kind, "question": question, "asks": item["count"], "cost_tokens": cost}
+            if not ok:
+                # Upstream is failing (likely rate limited): stop spending
+                report["failed"].append(entry)
+                report["stopped_reason"] = "upstream errors"
+                break
+            cache_store(kind, question, payload, cost, source="warm")
+            report["warmed"].append(entry)
+        
+        if report["stopped_reason"] == "no more candidates" and report["skipped_over_budget"]:
+            report["stopped_reason"] = "budget exhausted"
+        report["finished_at"] = datetime.now(timezone.utc).isoformat()
+        # GET /cache is public: publish counts and costs, never users' questions
+        cache.save_report("cache_warmup", {
+            **report,
+            "warmed": [{k: v for k, v in e.items() if k != "question"} for e in report["warmed"]],
+            "failed": [{k: v for k, v in e.items() if k != "question"} for e in report["failed"]]
+        })
+        print(f"[WARM] Done: warmed {len(report['warmed'])}, spent {report['spent']} tokens "
+              f"({report['stopped_reason']})")
+        return report
+    
+    finally:
+        cache.release_lock("cache_warmup", lock_owner)
+
+
+def _warm_scheduler_loop():
+    interval = _env_int("CACHE_WARM_CHECK_SECONDS", 300)
+    while True:
+        time.sleep(interval)
+        try:
+            if not warm_window_open():
+                continue
+            # One run per reset period across all workers
+            run_key = token_usage["reset_time"].isoformat()
+            if get_response_cache().claim_job("cache_warmup", run_key):
+                run_cache_warmup(trigger="schedule")
+        except Exception as e:
+            print(f"[WARM] ⚠ Scheduler error: {e}")
+
+
+@council_bp.before_app_request
+def start_warm_scheduler():
+    """
+    Start the warm-up scheduler thread on the first request. Lazily, so it
+    runs in each worker rather than in the preloaded master (threads do not
+    survive fork).
+    """
+    if warm_state["scheduler_started"] or os.getenv("CACHE_WARM_ENABLED", "0") != "1":
+        return
+    with _warm_scheduler_lock:
+        if warm_state["scheduler_started"]:
+            return
+        warm_state["scheduler_started"] = True
+    threading.Thread(target=_warm_scheduler_loop, name="cache-warm", daemon=True).start()
+    print("[WARM] Scheduler started")
+
+
+
+# =============================================================================
+# SPECULATIVE PREFETCH (brief + routing while the user types)
+# =============================================================================
+# Stages 1-2 depend only on the question text, so the frontend can POST the
+# draft to /council/prefetch once typing pauses (debounced). The results go
+# into the shared response cache as kind "speculative" with a short TTL,
+# scoped to the client (client_identity) so one user's drafts never answer
+# another's question. run_council_pipeline reuses them when the submitted
+# question is the draft plus at most a few trailing words: any edit inside
+# the draft ("I should quit" -> "I should not quit") is a miss.
+#
+# Config (env):
+#   PREFETCH_TOKEN_BUDGET   daily tokens per worker for speculation (default 10000)
+#   PREFETCH_MIN_REMAINING  skip when fewer daily tokens remain (default 20000)
+#   PREFETCH_MAX_EXTRA_WORDS words typed after the draft that still reuse it (default 3)
+#   PREFETCH_MIN_WORDS      ignore shorter drafts (default 4)
+#   PREFETCH_TTL            seconds a speculative result stays usable (default 600)
+#   PREFETCH_ROUTING        1 = also prefetch Stage 2 routing (default 1)
+
+
+# First-run estimate of one speculation's cost, before any are measured
+PREFETCH_DEFAULT_COST = 1200
+
+speculation = {
+    "spent": 0,
+    "reset_time": None,
+    "prefetch_requests": 0,
+    "computed": 0,
+    "already_cached": 0,
+    "skipped": 0,
+    "lookups": 0,
+    "hits": 0,
+    "near_hits": 0
+}
+_speculation_lock = threading.Lock()
+_speculation_in_progress = set()
+
+
+def _speculative_match(client, question):
+    """
+    The client's latest draft that `question` only adds to, within
+    PREFETCH_MAX_EXTRA_WORDS. Returns (payload, extra_words) or (None, None).
+    """
+    payload, extra = get_response_cache().longest_prefix("speculative", client, question)
+    if payload is None or len(extra.split()) > _env_int("PREFETCH_MAX_EXTRA_WORDS", 3):
+        return None, None
+    return payload, len(extra.split())
+
+
+def _count_speculation(stat, amount=1):
+    with _speculation_lock:
+        speculation[stat] += amount
+
+
+def _speculation_budget_left():
+    with _speculation_lock:
+        now = datetime.now(timezone.utc)
+        if speculation["reset_time"] is None or now >= speculation["reset_time"]:
+            speculation["spent"] = 0
+            speculation["reset_time"] = next_token_reset(now)
+        return _env_int("PREFETCH_TOKEN_BUDGET", 10000) - speculation["spent"]
+
+
+def find_speculative_stages(question, client=None):
+    """
+    Look up a brief/routing this client prefetched for this question.
+    Without a client (e.g. the warm-up job) there is nothing to look up.
+    
+    Returns (payload or None, report) where report says whether Stage 1/2
+    were served speculatively and how many words were typed after the draft.
+    """
+    if client is None:
+        return None, {"brief": "miss", "routing": "miss", "extra_words": None}
+    
+    _count_speculation("lookups")
+    try:
+        payload, extra_words = _speculative_match(client, question)
+    except Exception as e:
+        print(f"[PREFETCH] ⚠ Lookup failed: {e}")
+        payload, extra_words = None, None
+    
+    if payload is None:
+        return None, {"brief": "miss", "routing": "miss", "extra_words": None}
+    
+    _count_speculation("hits")
+    if extra_words:
+        _count_speculation("near_hits")
+    return payload, {
+        "brief": "hit",
+        "routing": "hit" if payload.get("routing") else "miss",
+        "extra_words": extra_words
+    }
+
+
+def speculation_snapshot():
+    with _speculation_lock:
+        stats = {k: v for k, v in speculation.items() if k != "reset_time"}
+    stats["budget"] = _env_int("PREFETCH_TOKEN_BUDGET", 10000)
+    stats["hit_rate"] = round(stats["hits"] / stats["lookups"], 3) if stats["lookups"] else None
+    # Share of computed speculations that a real debate went on to use
+    stats["use_rate"] = round(stats["hits"] / stats["computed"], 3) if stats["computed"] else None
+    return stats
+
+
+@council_bp.route("/council/prefetch", methods=["POST"])
+def council_prefetch():
+    """
+    Speculatively compute Stage 1 (and Stage 2) for a draft question.
+    
+    Call from the frontend once typing pauses, fire-and-forget, e.g. with a
+    ~800ms debounce on the input event:
+        fetch('/council/prefetch', {method: 'POST', body: JSON.stringify({draft})})
+    
+    Request: { draft, routing? }
+    Response: { status: computed|cached|skipped, reason?, cost_tokens? }
+    """
+    data = request.json or {}
+    draft = (data.get("draft") or "").strip()
+    include_routing = data.get("routing", os.getenv("PREFETCH_ROUTING", "1") == "1")
+    _count_speculation("prefetch_requests")
+    
+    def skipped(reason):
+        _count_speculation("skipped")
+        return jsonify({"status": "skipped", "reason": reason})
+    
+    if len(draft.split()) < _env_int("PREFETCH_MIN_WORDS", 4) or len(draft) > 1000:
+        return skipped("draft too short or too long")
+    
+    client = client_identity()
+    cache = get_response_cache()
+    # Only an exact match makes this draft redundant: a longer draft still gets
+    # its own entry, or the next few words would push past PREFETCH_MAX_EXTRA_WORDS
+    existing, extra_words = _speculative_match(client, draft)
+    if existing is not None and extra_words == 0 and (existing.get("routing") or not include_routing):
+        _count_speculation("already_cached")
+        return jsonify({"status": "cached"})
+    
+    # Never let speculation eat into what real requests need
+    with _speculation_lock:
+        estimate = speculation["spent"] // speculation["computed"] if speculation["computed"] else PREFETCH_DEFAULT_COST
+    if _speculation_budget_left() < estimate:
+        return skipped("speculation budget spent")
+    if shared_tokens_remaining() < _env_int("PREFETCH_MIN_REMAINING", 20000):
+        return skipped("daily token budget low")
+    
+    key = f"{client}|{normalize_question(draft)}"
+    with _speculation_lock:
+        if key in _speculation_in_progress:
+            in_progress = True
+        else:
+            in_progress = False
+            _speculation_in_progress.add(key)
+    if in_progress:
+        return skipped("already in progress")
+    
+    meter = {"tokens": 0}
+    try:
+        with metered_tokens() as meter:
+            brief_json, brief_ok = generate_psychological_brief(draft)
+            routing_json, routing_ok = (None, False)
+            if brief_ok and include_routing:
+                routing_json, routing_ok = generate_debate_parameters(brief_json)
+    except SchedulerOverloaded:
+        raise
+    except Exception as e:
+        print(f"[PREFETCH] ✗ Error: {e}")
+        return skipped("upstream error")
+    finally:
+        with _speculation_lock:
+            _speculation_in_progress.discard(key)
+            speculation["spent"] += meter["tokens"]
+    
+    _count_speculation("computed")
+    
+    # Fallback (unparsed) output is not worth reusing
+    if not brief_ok:
+        return jsonify({"status": "skipped", "reason": "brief unparseable", "cost_tokens": meter["tokens"]})
+    
+    cache.put(
+        "speculative", draft,
+        {"draft": draft, "brief": brief_json, "routing": routing_json if routing_ok else None},
+        cost_tokens=meter["tokens"], source="speculative", ttl=_env_int("PREFETCH_TTL", 600), scope=client
+    )
+    print(f"[PREFETCH] ✓ Speculated on draft ({meter['tokens']} tokens): {draft[:60]}")
+    return jsonify({"status": "computed", "cost_tokens": meter["tokens"]})
 
 
 
@@ -395,7 +1371,7 @@ Give YOUR perspective. Be distinct. Be sharp."""
 # =============================================================================
 
 
-@app.route("/council/debate", methods=["POST"])
+@council_bp.route("/council/debate", methods=["POST"])
 def council_debate():
     """
     Main endpoint for the Hybrid Cognitive Pipeline debate.
@@ -407,20 +1383,58 @@ def council_debate():
     if not question:
         return jsonify({"error": "Question required"}), 400
     
+    cache_log_question("debate", question)
+    cached = cache_lookup("debate", question)
+    if cached is not None:
+        print("[PIPELINE] ✓ Served from cache")
+        # Fan-out and speculation describe the run that filled the cache, not this request
+        return jsonify({**cached, "speculation": None, "cached": True})
+    
     # Run the 4-stage pipeline
-    result = run_council_pipeline(question)
+    with metered_tokens() as meter:
+        result = run_council_pipeline(question, client_identity())
+    payload = build_debate_response(result)
     
-    return jsonify({
+    entry = cacheable_debate(result, payload)
+    if entry is not None:
+        cache_store("debate", question, entry, meter["tokens"])
+    
+    return jsonify({**payload, "cached": False})
+
+
+def build_debate_response(result):
+    """Shape a run_council_pipeline() result into the /council/debate payload"""
+    return {
         "success": True,
         "pipeline_stages": {
             "psychological_brief": result.get("psychological_brief"),
             "debate_parameters": result.get("debate_parameters")
         },
         "debate": result.get("debate", []),
+        "fanout": result.get("fanout"),
+        "speculation": result.get("speculation"),
         "synthesis": result.get("synthesis", ""),
         "stages_completed": result.get("stages_completed", []),
         "total_stages": 4
-    })
+    }
+
+
+def cacheable_debate(result, payload):
+    """
+    The part of a /council/debate payload worth caching, or None if the run
+    was degraded (pipeline error, fallback brief/routing, any persona
+    fallback, or a fan-out tier cut down because the worker was under
+    load). Per-request fields (fanout's load snapshot, speculation) are
+    dropped; the tier stays, so cache hits still say how many spoke.
+    """
+    if "error" in result or result.get("fallbacks") or not (result.get("brief_parsed") and result.get("routing_parsed")):
+        return None
+    fanout = result.get("fanout")
+    if fanout is None or fanout.get("under_load"):
+        return None
+    entry = {k: v for k, v in payload.items() if k != "speculation"}
+    entry["fanout"] = {**fanout, "load": None}
+    return entry
 
 
 
@@ -428,7 +1442,7 @@ def council_debate():
 conversations = {}
 
 
-@app.route("/api/getResponses", methods=["POST"])
+@council_bp.route("/api/getResponses", methods=["POST"])
 def get_responses():
     """
     Roast Council - Simple parallel execution endpoint.
@@ -454,55 +1468,32 @@ def get_responses():
     
     print(f"[QUESTION] {question[:100]}...")
     
-    # Parallel execution with fallback handling
-    results = {}
-    lock = threading.Lock()
+    cache_log_question("roast", question)
+    cached = cache_lookup("roast", question)
+    if cached is not None:
+        print("[ROAST COUNCIL] ✓ Served from cache")
+        print("="*60 + "\n")
+        return jsonify({**cached, "cached": True})
     
-    def call_persona(persona_id):
-        persona = PERSONAS[persona_id]
-        print(f"[{persona['name']}] Calling Groq...")
-        
-        try:
-            response = groq_client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=[
-                    {"role": "system", "content": persona["system_prompt"]},
-                    {"role": "user", "content": question}
-                ],
-                temperature=0.9,
-                max_tokens=150,
-                timeout=10.0
-            )
-            message = response.choices[0].message.content.strip()
-            print(f"[{persona['name']}] ✓ Response received ({len(message)} chars)")
-        except Exception as e:
-            # Fallback on ANY error (rate limit, timeout, network, etc.)
-            print(f"[{persona['name']}] ✗ Error: {e}")
-            message = persona["fallback"]
-        
-        with lock:
-            results[persona_id] = {
-                "id": persona_id,
-                "name": persona["name"],
-                "emoji": persona["emoji"],
-                "response": message
-            }
+    with metered_tokens() as meter:
+        results, fallbacks = run_roast_council(question)
+    payload = {"results": results}
     
-    # Execute all 4 personas in parallel
-    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-        futures = [executor.submit(call_persona, pid) for pid in PERSONAS.keys()]
-        concurrent.futures.wait(futures, timeout=15)  # 15s max wait
+    # Only cache complete answers, never persona fallbacks
+    if fallbacks == 0 and len(results) == len(PERSONAS):
+        cache_store("roast", question, payload, meter["tokens"])
     
     print(f"[ROAST COUNCIL] Returning {len(results)} responses")
     print("="*60 + "\n")
     
-    return jsonify({"results": list(results.values())})
+    return jsonify({**payload, "cached": False})
 
 
 
-@app.route("/usage", methods=["GET"])
+@council_bp.route("/usage", methods=["GET"])
 def get_usage():
     """Endpoint to check current usage"""
+    tokens_remaining()  # rolls the counter over if the daily reset has passed
     usage_percent = int((token_usage["used"] / token_usage["limit"]) * 100) if token_usage["limit"] > 0 else 0
     return jsonify({
         "used": token_usage["used"],
@@ -513,7 +1504,55 @@ def get_usage():
 
 
 
-@app.route("/health", methods=["GET"])
+@council_bp.route("/cache", methods=["GET"])
+def get_cache_status():
+    """Response cache hit rate and entries, plus the last warm-up report"""
+    return jsonify({
+        "cache": get_response_cache().snapshot(),
+        "last_warmup": get_response_cache().load_report("cache_warmup"),
+        "speculation": speculation_snapshot(),
+        "warm_window_open": warm_window_open()
+    })
+
+
+
+@council_bp.route("/cache/warm", methods=["POST"])
+def trigger_cache_warm():
+    """
+    Start a warm-up run in the background (e.g. from an external cron that
+    also wakes a sleeping instance). Requires X-Admin-Token == ADMIN_TOKEN.
+    """
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token:
+        return jsonify({"error": "Cache warm-up endpoint disabled (ADMIN_TOKEN not set)"}), 403
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), admin_token):
+        return jsonify({"error": "Invalid admin token"}), 403
+    if get_response_cache().is_locked("cache_warmup"):
+        return jsonify({"status": "already_running"}), 409
+    
+    threading.Thread(target=run_cache_warmup, kwargs={"trigger": "manual"}, name="cache-warm-manual", daemon=True).start()
+    return jsonify({"status": "started", "report": "GET /cache"}), 202
+
+
+
+@council_bp.route("/scheduler", methods=["GET"])
+def get_scheduler_status():
+    """
+    Per-class queue depth, shed counts and wait times for upstream capacity,
+    plus concurrent requests held per class
+    """
+    return jsonify({**get_scheduler().snapshot(), "requests": get_request_limiter().snapshot()})
+
+
+
+@council_bp.route("/upstreams", methods=["GET"])
+def get_upstreams():
+    """Per-backend load, latency and health for the upstream pool"""
+    return jsonify({"backends": get_upstream_pool().snapshot()})
+
+
+
+@council_bp.route("/health", methods=["GET"])
 def health_check():
     """Quick sanity check - is everything actually working?"""
     try:
@@ -542,7 +1581,7 @@ def health_check():
 # =============================================================================
 
 
-@app.route("/chat", methods=["POST"])
+@council_bp.route("/chat", methods=["POST"])
 def chat():
     """Legacy single-persona chat endpoint - now uses PersonaManager"""
     data = request.json or {}
@@ -599,7 +1638,7 @@ def chat():
 # =============================================================================
 
 
-@app.route('/')
+@council_bp.route('/')
 def serve_frontend():
     """Serve the Roast Council frontend"""
     backend_dir = os.path.dirname(os.path.abspath(__file__))
@@ -611,21 +1650,28 @@ def serve_frontend():
 
 
 def validate_startup():
-    """Run before starting server"""
+    """
+    Run before starting server.
+    
+    The live API call and port-bind probe add a few seconds to every
+    start; set STARTUP_PROBES=0 to skip them on hosts that cold-start.
+    """
     errors = []
+    run_probes = os.getenv("STARTUP_PROBES", "1") != "0"
     
     # Check 1: API key exists
     if not os.getenv("GROQ_API_KEY"):
         errors.append("❌ GROQ_API_KEY missing in .env")
     
     # Check 2: API key works
-    try:
-        print("[STARTUP] Testing Groq API connection...")
-        test = call_groq("Say OK", temperature=0.1)
-        if not test:
-            errors.append("❌ Groq API call returned empty")
-    except Exception as e:
-        errors.append(f"❌ Groq connection failed: {e}")
+    if run_probes:
+        try:
+            print("[STARTUP] Testing Groq API connection...")
+            test = call_groq("Say OK", temperature=0.1)
+            if not test:
+                errors.append("❌ Groq API call returned empty")
+        except Exception as e:
+            errors.append(f"❌ Groq connection failed: {e}")
     
     # Check 3: Personas loaded
     if len(PERSONAS) != 4:
@@ -633,15 +1679,16 @@ def validate_startup():
         errors.append(f"[X] Expected 4 personas, got {len(PERSONAS)}")
     
     # Check 4: Port available
-    import socket
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    try:
-        # Try binding to port 5000 (test if we CAN start)
-        sock.bind(('0.0.0.0', 5000))
-        sock.close()
-    except Exception as e:
-        errors.append(f"[X] Port 5000 unavailable: {e}")
+    if run_probes:
+        import socket
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            # Try binding to port 5000 (test if we CAN start)
+            sock.bind(('0.0.0.0', 5000))
+            sock.close()
+        except Exception as e:
+            errors.append(f"[X] Port 5000 unavailable: {e}")
     
     if errors:
         print("\n" + "="*60)
@@ -654,40 +1701,230 @@ def validate_startup():
     else:
         print("\n" + "="*60)
         print("[OK] STARTUP VALIDATION PASSED")
-        print(f"[OK] Groq API: Connected")
+        if run_probes:
+            print(f"[OK] Groq API: Connected")
         print(f"[OK] Personas: {len(PERSONAS)} loaded")
-        print(f"[OK] Port 5000: Available")
+        if run_probes:
+            print(f"[OK] Port 5000: Available")
         print("="*60 + "\n")
 
 
-import atexit
-import signal
+# =============================================================================
+# LIFECYCLE: READINESS & GRACEFUL DRAIN
+# =============================================================================
+# On SIGTERM: readiness goes false, new work gets a 503, and in-flight
+# requests and pipelines (including warm-up runs) get DRAIN_GRACE_SECONDS
+# (default 25) to finish. At that deadline a timer closes the drain: work
+# still running is counted as aborted, the summary is logged, and the shared
+# executor and upstream HTTP clients are shut down, so late work fails fast
+# instead of running on until gunicorn SIGKILLs the worker. Under gunicorn,
+# gunicorn.conf.py wires this into the worker's SIGTERM handling; the dev
+# server uses install_signal_handlers.
+
+
+# Endpoints that must keep answering while draining
+PROBE_ENDPOINTS = {"council.readiness", "council.health_check", "council.get_usage"}
+
+lifecycle = {
+    "ready": True,
+    "draining": False,
+    "in_flight": 0,
+    "drain_deadline": None,  # time.monotonic() by which the drain must end
+    "shutdowns": []   # one summary per drain (a worker normally drains once)
+}
+_lifecycle_lock = threading.Lock()
+_shutdown_lock = threading.Lock()
+
+
+def begin_drain(grace=None):
+    """
+    Stop taking new work and open this drain's summary. Safe to call more
+    than once; only the first call has an effect.
+    
+    The grace period starts here (at SIGTERM under gunicorn), not when
+    drain_and_shutdown() gets to run, and a timer finishes the drain when
+    it runs out even if nothing else does (e.g. gunicorn is still waiting
+    on a slow request and would SIGKILL before worker_exit).
+    """
+    grace = grace if grace is not None else _env_int("DRAIN_GRACE_SECONDS", 25)
+    with _lifecycle_lock:
+        if lifecycle["draining"]:
+            return
+        lifecycle["ready"] = False
+        lifecycle["draining"] = True
+        lifecycle["drain_deadline"] = time.monotonic() + grace
+        lifecycle["shutdowns"].append({
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "grace_seconds": grace,
+            "in_flight_at_start": lifecycle["in_flight"],
+            "pipelines_at_start": pipeline_load["active"],
+            "completed": 0,
+            "aborted": 0,
+            "pipelines_aborted": 0,
+            "refused": 0,
+            "finished": False
+        })
+    timer = threading.Timer(grace, finish_drain)
+    timer.daemon = True
+    timer.start()
+    print(f"[SHUTDOWN] Draining: readiness off, {lifecycle['in_flight']} request(s) in flight")
+
+
+@council_bp.before_app_request
+def track_in_flight():
+    if request.endpoint in PROBE_ENDPOINTS:
+        return None
+    with _lifecycle_lock:
+        refused = lifecycle["draining"]
+        if refused:
+            lifecycle["shutdowns"][-1]["refused"] += 1
+        else:
+            lifecycle["in_flight"] += 1
+            g.drain_tracked = True
+    if refused:
+        response = jsonify({"error": "Server is shutting down, please retry"})
+        response.status_code = 503
+        response.headers["Retry-After"] = "5"
+        return response
+    return None
+
+
+@council_bp.teardown_app_request
+def release_in_flight(exc):
+    if g.pop("drain_tracked", False):
+        with _lifecycle_lock:
+            lifecycle["in_flight"] -= 1
+            # Once the drain is finished, stragglers were already counted as aborted
+            if lifecycle["draining"] and not lifecycle["shutdowns"][-1]["finished"]:
+                lifecycle["shutdowns"][-1]["completed"] += 1
+
+
+def finish_drain():
+    """
+    Close the current drain: count what is still running as aborted, shut
+    down the shared executor and upstream HTTP clients, and log the summary.
+    
+    The executor and pool are shut down but kept in place, so anything still
+    running fails fast rather than building new ones. Idempotent; returns
+    the summary.
+    """
+    with _shutdown_lock:
+        summary = lifecycle["shutdowns"][-1]
+        if summary["finished"]:
+            return summary
+        
+        with _lifecycle_lock:
+            summary["aborted"] = max(0, lifecycle["in_flight"])
+            summary["pipelines_aborted"] = max(0, pipeline_load["active"])
+            summary["finished"] = True
+        
+        # Nothing should be queued by now; anything left is abandoned
+        if _llm_executor is not None:
+            _llm_executor.shutdown(wait=False, cancel_futures=True)
+        if _upstream_pool is not None:
+            _upstream_pool.close()
+        
+        print("\n" + "="*60)
+        print(f"[SHUTDOWN] Drain complete: {summary['completed']} completed, "
+              f"{summary['aborted']} aborted, {summary['refused']} refused "
+              f"({summary['pipelines_aborted']} pipelines cut off)")
+        print("="*60)
+        return summary
+
+
+def drain_and_shutdown(grace=None):
+    """
+    Drain in-flight work, then release pooled resources.
+    
+    Waits until `grace` seconds (DRAIN_GRACE_SECONDS) after the drain began
+    for in-flight requests and pipelines to finish, then finishes the drain
+    (finish_drain) without waiting for its timer. Returns this drain's
+    summary of requests completed vs aborted; later calls return the same
+    summary.
+    """
+    begin_drain(grace)
+    while time.monotonic() < lifecycle["drain_deadline"] and not lifecycle["shutdowns"][-1]["finished"]:
+        if lifecycle["in_flight"] <= 0 and pipeline_load["active"] <= 0:
+            break
+        time.sleep(0.1)
+    return finish_drain()
+
+
+def install_signal_handlers():
+    """
+    Register drain handlers for the standalone dev server.
+    
+    Not done at import: under gunicorn the arbiter owns SIGTERM/SIGINT
+    and a handler installed by the preloaded app would be overwritten
+    (or, worse, inherited by workers). See gunicorn.conf.py instead.
+    """
+    atexit.register(drain_and_shutdown)
+    signal.signal(signal.SIGINT, lambda s, f: (drain_and_shutdown(), exit(0)))
+    signal.signal(signal.SIGTERM, lambda s, f: (drain_and_shutdown(), exit(0)))
+
+
+@council_bp.route("/ready", methods=["GET"])
+def readiness():
+    """Readiness probe: 503 once the worker starts draining"""
+    body = {
+        "ready": lifecycle["ready"],
+        "in_flight": lifecycle["in_flight"],
+        "active_pipelines": pipeline_load["active"],
+        "last_shutdown": lifecycle["shutdowns"][-1] if lifecycle["shutdowns"] else None
+    }
+    return jsonify(body), (200 if lifecycle["ready"] else 503)
+
+
+
+# =============================================================================
+# APP FACTORY
+# =============================================================================
+
+
+def create_app():
+    """
+    Build the Flask app.
+    
+    Cheap by design: no API client, no network calls. Everything read-only
+    (PERSONAS, prompt templates, persona maps) is already built at module
+    import, so with gunicorn `preload_app` it lives in the master and is
+    shared copy-on-write by every worker. The upstream pool is created per
+    worker on first use.
+    """
+    from dotenv import load_dotenv
+    load_dotenv()
+    
+    flask_app = Flask(__name__)
+    CORS(flask_app, resources={
+        r"/*": {
+            "origins": ["https://depth-chi.vercel.app", "https://depth-qiu9wulnc-jins-projects-ee877f80.vercel.app", "*"],
+            "methods": ["GET", "POST", "OPTIONS"],
+            "allow_headers": ["Content-Type", "X-API-Key"]
+        }
+    })
+    # Trust only the X-Forwarded-For hops our own proxies add (client_identity)
+    proxy_hops = _env_int("TRUSTED_PROXY_HOPS", 1)
+    if proxy_hops > 0:
+        flask_app.wsgi_app = ProxyFix(flask_app.wsgi_app, x_for=proxy_hops)
+    flask_app.register_blueprint(council_bp)
+    
+    # Roast Council initialized
+    print(f"[INIT] Roast Council loaded: {len(PERSONAS)} personas ready")
+    return flask_app
 
-def cleanup():
-    """Called when server stops"""
-    print("\n" + "="*60)
-    print("[SHUTDOWN] Cleaning up...")
-    print("="*60)
-    # Force close ThreadPoolExecutor if it exists
-    import concurrent.futures
-    # Shutdown any active executors
-    for obj in gc.get_objects():
-        if isinstance(obj, concurrent.futures.ThreadPoolExecutor):
-            obj.shutdown(wait=False)
 
-# Register cleanup handlers
-atexit.register(cleanup)
-signal.signal(signal.SIGINT, lambda s, f: (cleanup(), exit(0)))
-signal.signal(signal.SIGTERM, lambda s, f: (cleanup(), exit(0)))
+# Module-level app so `gunicorn app:app` keeps working
+app = create_app()
 
 
 if __name__ == "__main__":
+    install_signal_handlers()
     validate_startup()
     port = int(os.environ.get("PORT", 5000))
     print(f"\n{'='*60}")
     print(f"[STARTUP] Depth AI Council Backend")
     print(f"[STARTUP] Port: {port}")
-    print(f"[STARTUP] Groq API Key: {'✓ Configured' if groq_api_key else '✗ Missing'}")
+    print(f"[STARTUP] Groq API Key: {'✓ Configured' if os.getenv('GROQ_API_KEY') else '✗ Missing'}")
     print(f"[STARTUP] Roast Council: {len(PERSONAS)} personas ready")
     print(f"{'='*60}\n")
     app.run(host="0.0.0.0", port=port, debug=False)
@@ -0,0 +1,112 @@
+"""
+Cold start benchmark: import-to-first-response time for the backend.
+
+Each run spawns a fresh interpreter (so nothing is cached in-process),
+imports app, and serves requests through the Flask test client:
+
+    first_response_ms   import + GET /usage, which needs no upstream call
+    first_upstream_ms   POST /api/getResponses right after: pays for what
+                        is deferred to first use (groq/httpx/pydantic
+                        import, upstream pool, executor, response cache)
+    warm_upstream_ms    the same request again, for comparison
+
+Upstream calls go to a local stub speaking the Groq API (GROQ_BASE_URL),
+so the numbers measure our own cost rather than Groq latency. The cache
+is a fresh temp file, so nothing is served from it.
+
+Usage:
+    cd backend && python bench_cold_start.py [runs]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+
+CHILD = """
+import json, os, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class Stub(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = json.dumps({
+            "id": "bench", "object": "chat.completion", "created": 0, "model": "bench",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": "Benchmark reply."}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+stub = ThreadingHTTPServer(("127.0.0.1", 0), Stub)
+threading.Thread(target=stub.serve_forever, daemon=True).start()
+os.environ["GROQ_BASE_URL"] = f"http://127.0.0.1:{stub.server_port}"
+
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+client = app.app.test_client()
+resp = client.get("/usage")
+t2 = time.perf_counter()
+first = client.post("/api/getResponses", json={"question": "Should I take the job offer abroad?"})
+t3 = time.perf_counter()
+warm = client.post("/api/getResponses", json={"question": "Should I learn to play the cello?"})
+t4 = time.perf_counter()
+print(json.dumps({
+    "import_ms": (t1 - t0) * 1000,
+    "first_response_ms": (t2 - t0) * 1000,
+    "first_upstream_ms": (t3 - t2) * 1000,
+    "warm_upstream_ms": (t4 - t3) * 1000,
+    "statuses": [resp.status_code, first.status_code, warm.status_code],
+}))
+"""
+
+
+def run_once():
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "GROQ_API_KEY": "bench",
+            "RESPONSE_CACHE_PATH": os.path.join(tmp, "cache.sqlite3"),
+            "STARTUP_PROBES": "0",
+        }
+        env.pop("GROQ_API_KEYS", None)
+        env.pop("OPENAI_COMPAT_BACKENDS", None)
+        out = subprocess.run(
+            [sys.executable, "-c", CHILD],
+            cwd=backend_dir,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    # The app prints banners; the measurement is the last line
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    samples = [run_once() for _ in range(runs)]
+    
+    for key in ("import_ms", "first_response_ms", "first_upstream_ms", "warm_upstream_ms"):
+        values = [s[key] for s in samples]
+        print(f"[BENCH] {key}: median={statistics.median(values):.1f} "
+              f"min={min(values):.1f} max={max(values):.1f} (n={runs})")
+    
+    statuses = {code for s in samples for code in s["statuses"]}
+    if statuses != {200}:
+        print(f"[BENCH] ⚠ unexpected status codes: {statuses}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""
+Response Cache - shared cache of finished responses plus a question log.
+
+Backed by a small SQLite file so every gunicorn worker on the host sees the
+same entries (an in-memory dict would only help the worker that filled it).
+A new connection is opened per operation, so nothing is shared across fork.
+
+Tables:
+    responses   (kind, key) -> JSON payload, expiry, token cost; the key is
+                the normalized question, prefixed "<scope>|" for per-client kinds
+    questions   one row per asked question, used to rank what to warm
+    job_runs    last run of each scheduled job, so only one worker runs it
+    job_locks   cross-worker locks, so a job never runs twice at once
+    job_reports last report of each job, readable from any worker
+    token_spend tokens used per reset period, summed across workers
+
+Config (env):
+    RESPONSE_CACHE_PATH   SQLite file (default: <tmpdir>/depth_response_cache.sqlite3)
+    RESPONSE_CACHE_TTL    seconds an entry stays fresh (default 86400)
+"""
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+
+DEFAULT_TTL = 86400
+# Question log rows older than this are pruned
+QUESTION_LOG_RETENTION = 7 * 86400
+
+
+def normalize_question(question):
+    """Cache key for a question: lowercase, collapsed whitespace, no trailing punctuation"""
+    return re.sub(r"\s+", " ", question.strip().lower()).rstrip(" ?!.")
+
+
+class ResponseCache:
+    """SQLite-backed response cache with per-process hit/miss counters"""
+
+    def __init__(self, path=None, ttl=None):
+        self.path = path or os.getenv("RESPONSE_CACHE_PATH") or os.path.join(
+            tempfile.gettempdir(), "depth_response_cache.sqlite3"
+        )
+        self.ttl = ttl if ttl is not None else int(os.getenv("RESPONSE_CACHE_TTL", DEFAULT_TTL))
+        self.stats = {"hits": 0, "misses": 0, "writes": 0}
+        self._stats_lock = threading.Lock()
+        self._init_schema()
+
+    @contextmanager
+    def _connect(self):
+        """One short-lived connection per operation; commits on success"""
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_schema(self):
+        with self._connect() as conn:
+            # WAL lets workers read while another one writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    cost_tokens INTEGER NOT NULL DEFAULT 0,
+                    source TEXT NOT NULL DEFAULT 'live',
+                    PRIMARY KEY (kind, key)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS questions (
+                    key TEXT NOT NULL,
+                    question TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    asked_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_questions_asked_at ON questions (asked_at)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_runs (
+                    name TEXT PRIMARY KEY,
+                    run_key TEXT NOT NULL,
+                    started_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_locks (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_reports (
+                    name TEXT PRIMARY KEY,
+                    report TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS token_spend (
+                    period TEXT PRIMARY KEY,
+                    used INTEGER NOT NULL
+                )
+            """)
+
+    def _count(self, stat):
+        with self._stats_lock:
+            self.stats[stat] += 1
+
+    # -------------------------------------------------------------------------
+    # Responses
+    # -------------------------------------------------------------------------
+
+    def get(self, kind, question):
+        """Return the cached payload for a question, or None if missing/expired"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT payload FROM responses WHERE kind = ? AND key = ? AND expires_at > ?",
+                (kind, normalize_question(question), time.time())
+            ).fetchone()
+        self._count("hits" if row else "misses")
+        return json.loads(row[0]) if row else None
+
+    def contains(self, kind, question):
+        """Like get(), but without touching hit/miss counters"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM responses WHERE kind = ? AND key = ? AND expires_at > ?",
+                (kind, normalize_question(question), time.time())
+            ).fetchone()
+        return row is not None
+
+    def put(self, kind, question, payload, cost_tokens=0, source="live", ttl=None, scope=None):
+        """
+        Store a payload. Entries with a `scope` (e.g. a client id) are only
+        found by longest_prefix() lookups in that same scope.
+        """
+        now = time.time()
+        expires_at = now + (ttl if ttl is not None else self.ttl)
+        key = normalize_question(question)
+        if scope is not None:
+            key = f"{scope}|{key}"
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (kind, key, json.dumps(payload), now, expires_at, cost_tokens, source)
+            )
+            conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        self._count("writes")
+
+    def longest_prefix(self, kind, scope, question):
+        """
+        Entry in `scope` whose question is the longest word-aligned prefix
+        of this one (or equal to it), i.e. the last draft that was only added
+        to, never edited. Returns (payload, extra) where extra is the normalized text typed
+        after that draft ("" for an exact match), or (None, None). Does not
+        touch hit/miss counters; callers keep their own.
+        """
+        target = f"{scope}|{normalize_question(question)}"
+        with self._connect() as conn:
+            # Every prefix of target sorts between "<scope>|" and target, so the
+            # primary key index narrows the scan to this scope
+            row = conn.execute(
+                "SELECT key, payload FROM responses "
+                "WHERE kind = :kind AND key BETWEEN :floor AND :target AND expires_at > :now "
+                "AND substr(:target, 1, length(key)) = key "
+                "AND (length(key) = length(:target) OR substr(:target, length(key) + 1, 1) = ' ') "
+                "ORDER BY length(key) DESC LIMIT 1",
+                {"kind": kind, "floor": f"{scope}|", "target": target, "now": time.time()}
+            ).fetchone()
+        if row is None:
+            return None, None
+        return json.loads(row[1]), target[len(row[0]):].strip()
+
+    def average_cost(self, kind):
+        """Mean token cost of cached entries of this kind (None if unknown)"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT AVG(cost_tokens) FROM responses WHERE kind = ? AND cost_tokens > 0", (kind,)
+            ).fetchone()
+        return int(row[0]) if row and row[0] else None
+
+    # -------------------------------------------------------------------------
+    # Question log
+    # -------------------------------------------------------------------------
+
+    def log_question(self, kind, question):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO questions VALUES (?, ?, ?, ?)",
+                (normalize_question(question), question, kind, now)
+            )
+            conn.execute("DELETE FROM questions WHERE asked_at < ?", (now - QUESTION_LOG_RETENTION,))
+
+    def recent_question_count(self, seconds):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) FROM questions WHERE asked_at >= ?", (time.time() - seconds,)
+            ).fetchone()
+        return row[0]
+
+    def popular_questions(self, lookback_seconds, half_life_seconds):
+        """
+        Rank logged questions by recency-weighted frequency: each ask adds
+        0.5 ** (age / half_life), so frequent and recent both count.
+
+        Returns [{"question", "kind", "score", "count"}] sorted best first.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT key, question, kind, asked_at FROM questions WHERE asked_at >= ? ORDER BY asked_at",
+                (now - lookback_seconds,)
+            ).fetchall()
+
+        ranked = {}
+        for key, question, kind, asked_at in rows:
+            entry = ranked.setdefault((kind, key), {"question": question, "kind": kind, "score": 0.0, "count": 0})
+            entry["score"] += 0.5 ** ((now - asked_at) / half_life_seconds)
+            entry["count"] += 1
+            entry["question"] = question  # keep the latest phrasing
+        return sorted(ranked.values(), key=lambda e: e["score"], reverse=True)
+
+    # -------------------------------------------------------------------------
+    # Token spend
+    # -------------------------------------------------------------------------
+
+    def add_tokens(self, period, count):
+        """
+        Add to the host-wide token count for a reset period (an ISO
+        timestamp, so periods sort in time order). Older periods are dropped.
+        """
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO token_spend VALUES (?, ?) "
+                "ON CONFLICT (period) DO UPDATE SET used = used + excluded.used",
+                (period, count)
+            )
+            conn.execute("DELETE FROM token_spend WHERE period < ?", (period,))
+
+    def tokens_used(self, period):
+        """Tokens every worker has recorded for this reset period"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT used FROM token_spend WHERE period = ?", (period,)).fetchone()
+        return row[0] if row else 0
+
+    # -------------------------------------------------------------------------
+    # Job coordination
+    # -------------------------------------------------------------------------
+
+    def claim_job(self, name, run_key):
+        """
+        Claim a job run across all workers. Returns True for exactly one
+        caller per (name, run_key), e.g. one warm-up per day.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT run_key FROM job_runs WHERE name = ?", (name,)).fetchone()
+            if row and row[0] == run_key:
+                return False
+            conn.execute("INSERT OR REPLACE INTO job_runs VALUES (?, ?, ?)", (name, run_key, time.time()))
+            return True
+
+    def acquire_lock(self, name, owner, ttl):
+        """
+        Take a named lock shared by all workers. It expires after `ttl`
+        seconds so a worker killed mid-job can't hold it forever. Returns
+        True if `owner` now holds it.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT owner, expires_at FROM job_locks WHERE name = ?", (name,)).fetchone()
+            if row and row[0] != owner and row[1] > now:
+                return False
+            conn.execute("INSERT OR REPLACE INTO job_locks VALUES (?, ?, ?)", (name, owner, now + ttl))
+            return True
+
+    def release_lock(self, name, owner):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM job_locks WHERE name = ? AND owner = ?", (name, owner))
+
+    def is_locked(self, name):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM job_locks WHERE name = ? AND expires_at > ?", (name, time.time())
+            ).fetchone()
+        return row is not None
+
+    def save_report(self, name, report):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO job_reports VALUES (?, ?, ?)", (name, json.dumps(report), time.time())
+            )
+
+    def load_report(self, name):
+        with self._connect() as conn:
+            row = conn.execute("SELECT report FROM job_reports WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def snapshot(self):
+        with self._connect() as conn:
+            entries = dict(conn.execute(
+                "SELECT source, COUNT(*) FROM responses WHERE expires_at > ? GROUP BY source", (time.time(),)
+            ).fetchall())
+        with self._stats_lock:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else None
+        stats["entries"] = entries
+        return stats
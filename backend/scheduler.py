@@ -0,0 +1,373 @@
+"""
+Upstream Scheduler - per-client weighted fair queueing for LLM calls.
+
+Every upstream call takes one of `capacity` slots. When all slots are busy,
+calls wait in a shared queue ordered by weighted fair queueing: each
+(priority class, client) pair is a flow, and each call gets a finish tag of
+start + 1/weight, where start = max(virtual time, the flow's last finish
+tag). The lowest tag goes next, so a client firing many calls only
+delays itself, and a class with weight 4 gets ~4x the slots of a class
+with weight 1 when both are backlogged.
+
+Waits are bounded: a full class queue, or a client over its queued-call
+cap, is rejected at once; a call still queued after the class's max_wait
+gives up. Both raise SchedulerOverloaded, which the app turns into a 503
+with Retry-After.
+
+The queue only orders upstream calls, but a request holds one of the
+worker's HTTP threads for its whole life, and requests waiting for a
+thread sit in gunicorn's FIFO where no fair ordering applies. So
+RequestLimiter also caps concurrent requests per class and per (client,
+class) to a share of the worker's threads: a client's pile of debates is
+shed with a 503 instead of occupying every thread.
+
+Config (env):
+    UPSTREAM_CONCURRENCY       slots per worker (default 8)
+    SCHEDULER_MAX_PER_CLIENT   queued calls per client (default 16)
+    SCHEDULER_CLASSES          JSON overriding DEFAULT_CLASSES below
+    GUNICORN_THREADS           HTTP threads per worker (default 8)
+    REQUEST_LIMITS             JSON overriding DEFAULT_REQUEST_LIMITS below
+"""
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+DEFAULT_CLASSES = {
+    "interactive": {"weight": 4.0, "max_wait": 5.0, "max_queue": 64},
+    "bulk":        {"weight": 1.0, "max_wait": 15.0, "max_queue": 32},
+    # Speculative prefetch: worthless if late, so shed quickly
+    "speculative": {"weight": 0.5, "max_wait": 2.0, "max_queue": 8},
+    "background":  {"weight": 0.25, "max_wait": 30.0, "max_queue": 16}
+}
+
+# Share of the worker's HTTP threads each class may hold, in total and per
+# client. Interactive can use every thread; bulk debates leave half free.
+DEFAULT_REQUEST_LIMITS = {
+    "interactive": {"share": 1.0, "client_share": 0.5},
+    "bulk":        {"share": 0.5, "client_share": 0.25},
+    "speculative": {"share": 0.25, "client_share": 0.125}
+}
+
+# Recent wait samples kept per class for the exported percentiles
+WAIT_SAMPLES = 500
+# Prune idle flows' finish tags once this many are tracked
+MAX_TRACKED_FLOWS = 1000
+
+
+class SchedulerOverloaded(Exception):
+    """Upstream capacity is saturated for this class; retry after `retry_after` seconds"""
+    def __init__(self, message, priority_class, retry_after):
+        super().__init__(message)
+        self.priority_class = priority_class
+        self.retry_after = retry_after
+
+
+class FairScheduler:
+    """Weighted fair queue in front of a fixed number of upstream slots"""
+
+    def __init__(self, capacity=8, classes=None, max_per_client=16):
+        self.capacity = capacity
+        self.classes = classes or DEFAULT_CLASSES
+        self.max_per_client = max_per_client
+
+        self._cond = threading.Condition()
+        self._in_service = 0
+        self._virtual_time = 0.0
+        self._flow_finish = {}
+        self._flow_queued = {}
+        self._queue = []  # heap of (finish_tag, seq, waiter)
+        self._seq = itertools.count()
+        self._stats = {
+            name: {
+                "queued": 0,
+                "in_service": 0,
+                "admitted": 0,
+                "shed_queue_full": 0,
+                "shed_timeout": 0,
+                "waits": deque(maxlen=WAIT_SAMPLES)
+            }
+            for name in self.classes
+        }
+
+    def _class(self, priority_class):
+        return priority_class if priority_class in self.classes else "interactive"
+
+    def _retry_after(self, priority_class):
+        # Recent average wait is a fair guess at how long until there is room
+        waits = self._stats[priority_class]["waits"]
+        average = sum(waits) / len(waits) if waits else self.classes[priority_class]["max_wait"]
+        return max(1, min(30, round(average)))
+
+    def _overloaded(self, priority_class, reason):
+        return SchedulerOverloaded(
+            f"Upstream capacity busy for {priority_class} requests ({reason})",
+            priority_class,
+            self._retry_after(priority_class)
+        )
+
+    def _check_bounds(self, client, priority_class):
+        # Caller holds self._cond
+        stats = self._stats[priority_class]
+        if stats["queued"] >= self.classes[priority_class]["max_queue"]:
+            stats["shed_queue_full"] += 1
+            raise self._overloaded(priority_class, "queue full")
+        if self._flow_queued.get((priority_class, client), 0) >= self.max_per_client:
+            stats["shed_queue_full"] += 1
+            raise self._overloaded(priority_class, "too many queued calls for this client")
+
+    def check_admission(self, client, priority_class):
+        """
+        Fast pre-check before a request starts any work: raises
+        SchedulerOverloaded if its calls would be rejected right now.
+        """
+        priority_class = self._class(priority_class)
+        with self._cond:
+            if self._in_service >= self.capacity:
+                self._check_bounds(client, priority_class)
+
+    def _tag(self, flow, weight):
+        start = max(self._virtual_time, self._flow_finish.get(flow, 0.0))
+        finish = start + 1.0 / weight
+        self._flow_finish[flow] = finish
+        return start, finish
+
+    def _dispatch(self):
+        # Caller holds self._cond: hand free slots to the lowest finish tags
+        while self._in_service < self.capacity and self._queue:
+            _, _, waiter = heapq.heappop(self._queue)
+            if waiter["cancelled"]:
+                continue
+            waiter["granted"] = True
+            self._virtual_time = max(self._virtual_time, waiter["start"])
+            self._in_service += 1
+            self._dequeued(waiter)
+            self._stats[waiter["class"]]["in_service"] += 1
+        self._cond.notify_all()
+
+        if not self._queue and self._in_service == 0:
+            # Idle: forget history so tags don't grow without bound
+            self._virtual_time = 0.0
+            self._flow_finish.clear()
+        elif len(self._flow_finish) > MAX_TRACKED_FLOWS:
+            self._flow_finish = {f: t for f, t in self._flow_finish.items() if t > self._virtual_time}
+
+    def _dequeued(self, waiter):
+        flow = waiter["flow"]
+        self._stats[waiter["class"]]["queued"] -= 1
+        self._flow_queued[flow] -= 1
+        if not self._flow_queued[flow]:
+            del self._flow_queued[flow]
+
+    def acquire(self, client, priority_class):
+        """Block until this call may go upstream; returns the class used"""
+        priority_class = self._class(priority_class)
+        config = self.classes[priority_class]
+        flow = (priority_class, client)
+        enqueued_at = time.monotonic()
+
+        with self._cond:
+            stats = self._stats[priority_class]
+
+            # Drop timed-out waiters so they don't block the fast path
+            while self._queue and self._queue[0][2]["cancelled"]:
+                heapq.heappop(self._queue)
+
+            if self._in_service < self.capacity and not self._queue:
+                self._tag(flow, config["weight"])
+                self._in_service += 1
+                stats["in_service"] += 1
+                stats["admitted"] += 1
+                stats["waits"].append(0.0)
+                return priority_class
+
+            self._check_bounds(client, priority_class)
+            start, finish = self._tag(flow, config["weight"])
+            waiter = {"flow": flow, "class": priority_class, "start": start, "granted": False, "cancelled": False}
+            heapq.heappush(self._queue, (finish, next(self._seq), waiter))
+            stats["queued"] += 1
+            self._flow_queued[flow] = self._flow_queued.get(flow, 0) + 1
+            self._dispatch()
+
+            deadline = enqueued_at + config["max_wait"]
+            while not waiter["granted"]:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    waiter["cancelled"] = True
+                    self._dequeued(waiter)
+                    stats["shed_timeout"] += 1
+                    raise self._overloaded(priority_class, f"waited over {config['max_wait']:.0f}s")
+                self._cond.wait(remaining)
+
+            stats["admitted"] += 1
+            stats["waits"].append(time.monotonic() - enqueued_at)
+            return priority_class
+
+    def release(self, priority_class):
+        with self._cond:
+            self._in_service -= 1
+            self._stats[priority_class]["in_service"] -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, client, priority_class):
+        """Hold one upstream slot for the duration of the block"""
+        used_class = self.acquire(client, priority_class)
+        try:
+            yield
+        finally:
+            self.release(used_class)
+
+    def snapshot(self):
+        with self._cond:
+            classes = {}
+            for name, stats in self._stats.items():
+                waits = sorted(stats["waits"])
+                classes[name] = {
+                    **{k: v for k, v in stats.items() if k != "waits"},
+                    **self.classes[name],
+                    "wait_ms": {
+                        "avg": round(sum(waits) / len(waits) * 1000) if waits else None,
+                        "p50": round(waits[len(waits) // 2] * 1000) if waits else None,
+                        "p95": round(waits[int(len(waits) * 0.95)] * 1000) if waits else None,
+                        "max": round(waits[-1] * 1000) if waits else None
+                    }
+                }
+            return {
+                "capacity": self.capacity,
+                "in_service": self._in_service,
+                "queued": sum(s["queued"] for s in self._stats.values()),
+                "queued_clients": len(self._flow_queued),
+                "classes": classes
+            }
+
+
+class RequestLimiter:
+    """Caps concurrent requests per priority class and per (client, class)"""
+
+    def __init__(self, threads=8, limits=None):
+        self.threads = threads
+        self.limits = {
+            name: {
+                "max": max(1, round(threads * cfg["share"])),
+                "max_per_client": max(1, round(threads * cfg["client_share"]))
+            }
+            for name, cfg in (limits or DEFAULT_REQUEST_LIMITS).items()
+        }
+        self._lock = threading.Lock()
+        self._active = {name: 0 for name in self.limits}
+        self._per_client = {}
+        self._stats = {
+            name: {"admitted": 0, "shed_class_full": 0, "shed_client_full": 0,
+                   "durations": deque(maxlen=WAIT_SAMPLES)}
+            for name in self.limits
+        }
+
+    def _retry_after(self, priority_class):
+        # A slot frees up when a running request ends: guess from recent durations
+        durations = self._stats[priority_class]["durations"]
+        average = sum(durations) / len(durations) if durations else 5.0
+        return max(1, min(30, round(average)))
+
+    def admit(self, client, priority_class):
+        """
+        Take a request slot or raise SchedulerOverloaded. Returns a token
+        for release(), or None for classes without a limit.
+        """
+        limit = self.limits.get(priority_class)
+        if limit is None:
+            return None
+        key = (priority_class, client)
+        with self._lock:
+            stats = self._stats[priority_class]
+            if self._active[priority_class] >= limit["max"]:
+                stats["shed_class_full"] += 1
+                reason = "too many concurrent requests"
+            elif self._per_client.get(key, 0) >= limit["max_per_client"]:
+                stats["shed_client_full"] += 1
+                reason = "too many concurrent requests for this client"
+            else:
+                self._active[priority_class] += 1
+                self._per_client[key] = self._per_client.get(key, 0) + 1
+                stats["admitted"] += 1
+                return key, time.monotonic()
+            raise SchedulerOverloaded(
+                f"Request capacity busy for {priority_class} requests ({reason})",
+                priority_class,
+                self._retry_after(priority_class)
+            )
+
+    def release(self, token):
+        if token is None:
+            return
+        (priority_class, client), admitted_at = token
+        with self._lock:
+            self._active[priority_class] -= 1
+            key = (priority_class, client)
+            self._per_client[key] -= 1
+            if not self._per_client[key]:
+                del self._per_client[key]
+            self._stats[priority_class]["durations"].append(time.monotonic() - admitted_at)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "threads": self.threads,
+                "clients": len(self._per_client),
+                "classes": {
+                    name: {
+                        **limit,
+                        "active": self._active[name],
+                        **{k: v for k, v in self._stats[name].items() if k != "durations"},
+                        "retry_after": self._retry_after(name)
+                    }
+                    for name, limit in self.limits.items()
+                }
+            }
+
+
+def build_scheduler_from_env():
+    classes = {name: dict(cfg) for name, cfg in DEFAULT_CLASSES.items()}
+    raw = os.getenv("SCHEDULER_CLASSES")
+    if raw:
+        try:
+            for name, cfg in json.loads(raw).items():
+                classes.setdefault(name, dict(DEFAULT_CLASSES["bulk"])).update(cfg)
+        except (json.JSONDecodeError, AttributeError, TypeError) as e:
+            print(f"[SCHEDULER] ⚠ Ignoring invalid SCHEDULER_CLASSES: {e}")
+
+    try:
+        capacity = int(os.getenv("UPSTREAM_CONCURRENCY", "8"))
+        max_per_client = int(os.getenv("SCHEDULER_MAX_PER_CLIENT", "16"))
+    except ValueError:
+        capacity, max_per_client = 8, 16
+
+    print(f"[SCHEDULER] {capacity} upstream slots, classes: "
+          + ", ".join(f"{n} (w={c['weight']})" for n, c in classes.items()))
+    return FairScheduler(capacity=capacity, classes=classes, max_per_client=max_per_client)
+
+
+def build_request_limiter_from_env():
+    limits = {name: dict(cfg) for name, cfg in DEFAULT_REQUEST_LIMITS.items()}
+    raw = os.getenv("REQUEST_LIMITS")
+    if raw:
+        try:
+            for name, cfg in json.loads(raw).items():
+                limits.setdefault(name, dict(DEFAULT_REQUEST_LIMITS["bulk"])).update(cfg)
+        except (json.JSONDecodeError, AttributeError, TypeError) as e:
+            print(f"[SCHEDULER] ⚠ Ignoring invalid REQUEST_LIMITS: {e}")
+
+    try:
+        threads = int(os.getenv("GUNICORN_THREADS", "8"))
+    except ValueError:
+        threads = 8
+
+    limiter = RequestLimiter(threads=threads, limits=limits)
+    print(f"[SCHEDULER] Request limits over {threads} threads: "
+          + ", ".join(f"{n} {l['max']} ({l['max_per_client']}/client)" for n, l in limiter.limits.items()))
+    return limiter
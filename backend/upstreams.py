@@ -0,0 +1,336 @@
+"""
+Upstream LLM Pool - least-outstanding-requests balancing across backends.
+
+A backend is one Groq API key or one OpenAI-compatible base URL (e.g. a
+local model server). Each keeps its own in-flight count, latency average
+and health. Requests go to the healthy backend with the fewest outstanding
+requests, ties broken by recent latency. A 429 evicts a backend for its
+Retry-After window; repeated errors evict it with exponential backoff. It
+comes back automatically once the window passes.
+
+Only errors another backend might not share (429, 5xx, timeouts, dropped
+connections, malformed replies) fail over and count toward eviction. Any
+other 4xx is a problem with the request itself, so it is raised at once.
+
+Config (env):
+    GROQ_API_KEYS            comma-separated Groq keys (falls back to GROQ_API_KEY)
+    OPENAI_COMPAT_BACKENDS   JSON list of {"base_url", "api_key", "model", "name"}
+"""
+import json
+import os
+import threading
+import time
+
+
+DEFAULT_MODEL = "llama-3.3-70b-versatile"
+
+# Consecutive retryable non-429 failures before a backend is evicted
+FAILURE_THRESHOLD = 3
+# Eviction window when a 429 carries no Retry-After, and the backoff cap
+DEFAULT_COOLDOWN = 30.0
+MAX_COOLDOWN = 300.0
+# Weight of the newest sample in the latency moving average
+LATENCY_ALPHA = 0.3
+
+
+class UpstreamError(Exception):
+    """
+    Error from an upstream backend, carrying HTTP status and Retry-After if
+    known. `retryable` errors fail over to the next backend; by default that
+    is 429, 5xx, and anything without a status (timeouts, connection errors,
+    malformed replies).
+    """
+    def __init__(self, message, status_code=None, retry_after=None, retryable=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        if retryable is None:
+            retryable = status_code is None or status_code == 429 or status_code >= 500
+        self.retryable = retryable
+
+
+class Backend:
+    """One upstream endpoint plus its rate-limit and health state"""
+
+    def __init__(self, name, kind, api_key=None, base_url=None, model=DEFAULT_MODEL, max_retries=2):
+        self.name = name
+        self.kind = kind  # "groq" or "openai"
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.max_retries = max_retries
+
+        self.outstanding = 0
+        self.latency_ewma = None
+        self.consecutive_failures = 0
+        self.evicted_until = 0.0
+        self.cooldown = DEFAULT_COOLDOWN
+        self.stats = {"requests": 0, "errors": 0, "rate_limited": 0, "evictions": 0, "rejected": 0}
+
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def _get_client(self):
+        # Built lazily so nothing network-related exists before fork
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    if self.kind == "groq":
+                        from groq import Groq
+                        kwargs = {"api_key": self.api_key, "max_retries": self.max_retries}
+                        if self.base_url:
+                            kwargs["base_url"] = self.base_url
+                        self._client = Groq(**kwargs)
+                    else:
+                        import requests
+                        self._client = requests.Session()
+        return self._client
+
+    def complete(self, messages, temperature, max_tokens, timeout, require_json=False):
+        """Run one chat completion. Returns (text, total_tokens)."""
+        if self.kind == "groq":
+            return self._complete_groq(messages, temperature, max_tokens, timeout, require_json)
+        return self._complete_openai(messages, temperature, max_tokens, timeout, require_json)
+
+    def _complete_groq(self, messages, temperature, max_tokens, timeout, require_json):
+        kwargs = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "timeout": timeout
+        }
+        if require_json:
+            kwargs["response_format"] = {"type": "json_object"}
+
+        try:
+            completion = self._get_client().chat.completions.create(**kwargs)
+        except Exception as e:
+            status = getattr(e, "status_code", None)
+            headers = getattr(getattr(e, "response", None), "headers", None) or {}
+            raise UpstreamError(str(e), status_code=status, retry_after=_parse_retry_after(headers.get("retry-after"))) from e
+
+        try:
+            tokens = completion.usage.total_tokens if getattr(completion, "usage", None) else 0
+            return completion.choices[0].message.content.strip(), tokens
+        except (AttributeError, IndexError, TypeError) as e:
+            raise UpstreamError(f"{self.name} returned a malformed completion: {e}") from e
+
+    def _complete_openai(self, messages, temperature, max_tokens, timeout, require_json):
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+        if require_json:
+            payload["response_format"] = {"type": "json_object"}
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+
+        url = self.base_url.rstrip("/") + "/chat/completions"
+        try:
+            resp = self._get_client().post(url, json=payload, headers=headers, timeout=timeout)
+        except Exception as e:
+            raise UpstreamError(str(e)) from e
+
+        if resp.status_code >= 400:
+            raise UpstreamError(
+                f"{self.name} returned HTTP {resp.status_code}: {resp.text[:200]}",
+                status_code=resp.status_code,
+                retry_after=_parse_retry_after(resp.headers.get("retry-after"))
+            )
+
+        try:
+            data = resp.json()
+            tokens = (data.get("usage") or {}).get("total_tokens", 0)
+            return data["choices"][0]["message"]["content"].strip(), tokens
+        except (ValueError, AttributeError, KeyError, IndexError, TypeError) as e:
+            raise UpstreamError(f"{self.name} returned a malformed completion: {e}") from e
+
+    def close(self):
+        """Close the underlying HTTP client, if one was created"""
+        with self._client_lock:
+            client, self._client = self._client, None
+        if client is not None and hasattr(client, "close"):
+            client.close()
+
+    def snapshot(self, now):
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "model": self.model,
+            "healthy": now >= self.evicted_until,
+            "evicted_for": round(max(0.0, self.evicted_until - now), 1),
+            "outstanding": self.outstanding,
+            "latency_ms": round(self.latency_ewma * 1000) if self.latency_ewma is not None else None,
+            "consecutive_failures": self.consecutive_failures,
+            **self.stats
+        }
+
+
+class UpstreamPool:
+    """Picks a backend per request and tracks health across all of them"""
+
+    def __init__(self, backends):
+        if not backends:
+            raise ValueError("UpstreamPool needs at least one backend")
+        self.backends = backends
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def acquire(self, exclude=()):
+        """
+        Reserve the best backend: healthy first, then fewest outstanding
+        requests, then lowest recent latency. If every backend is evicted,
+        use the one that recovers soonest rather than failing outright.
+        Returns None only when every backend is in `exclude`.
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = [b for b in self.backends if b not in exclude]
+            if not candidates:
+                return None
+            healthy = [b for b in candidates if now >= b.evicted_until]
+            if healthy:
+                # Unmeasured backends sort first so they get a latency sample
+                backend = min(healthy, key=lambda b: (b.outstanding, b.latency_ewma or 0.0))
+            else:
+                backend = min(candidates, key=lambda b: b.evicted_until)
+            backend.outstanding += 1
+            backend.stats["requests"] += 1
+            return backend
+
+    def release(self, backend, latency=None, error=None):
+        """
+        Return a backend after a call and update its latency/health. Only
+        retryable UpstreamErrors count against its health; anything else
+        is the request's fault, not the backend's.
+        """
+        now = time.monotonic()
+        with self._lock:
+            backend.outstanding = max(0, backend.outstanding - 1)
+
+            if error is not None and not getattr(error, "retryable", False):
+                backend.stats["rejected"] += 1
+                return
+
+            if error is None:
+                if latency is not None:
+                    if backend.latency_ewma is None:
+                        backend.latency_ewma = latency
+                    else:
+                        backend.latency_ewma = LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * backend.latency_ewma
+                backend.consecutive_failures = 0
+                backend.cooldown = DEFAULT_COOLDOWN
+                return
+
+            backend.stats["errors"] += 1
+            backend.consecutive_failures += 1
+            status = getattr(error, "status_code", None)
+
+            if status == 429:
+                backend.stats["rate_limited"] += 1
+                window = getattr(error, "retry_after", None) or backend.cooldown
+            elif backend.consecutive_failures >= FAILURE_THRESHOLD:
+                window = backend.cooldown
+            else:
+                return
+
+            backend.evicted_until = now + window
+            backend.cooldown = min(MAX_COOLDOWN, backend.cooldown * 2)
+            backend.stats["evictions"] += 1
+            print(f"[UPSTREAM] Evicted {backend.name} for {window:.0f}s (status={status})")
+
+    def complete(self, messages, temperature=0.7, max_tokens=1000, timeout=10.0, require_json=False):
+        """
+        Run a chat completion on the best backend, failing over to the next
+        one on retryable errors. Returns (text, total_tokens, backend_name).
+        """
+        if self.closed:
+            raise UpstreamError("Upstream pool is closed (worker shutting down)", retryable=False)
+        tried = []
+        last_error = None
+        for _ in range(len(self.backends)):
+            backend = self.acquire(exclude=tried)
+            if backend is None:
+                break
+            tried.append(backend)
+            start = time.monotonic()
+            try:
+                text, tokens = backend.complete(messages, temperature, max_tokens, timeout, require_json)
+            except UpstreamError as e:
+                self.release(backend, error=e)
+                print(f"[UPSTREAM] {backend.name} failed: {e}")
+                if not e.retryable:
+                    raise
+                last_error = e
+                continue
+            except Exception as e:
+                self.release(backend, error=e)
+                raise
+            self.release(backend, latency=time.monotonic() - start)
+            return text, tokens, backend.name
+        raise last_error
+
+    def close(self):
+        """Close every backend's client; later complete() calls fail fast"""
+        self.closed = True
+        for backend in self.backends:
+            backend.close()
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            return [b.snapshot(now) for b in self.backends]
+
+
+def _parse_retry_after(value):
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def build_pool_from_env():
+    """
+    Build the pool from GROQ_API_KEYS / GROQ_API_KEY and
+    OPENAI_COMPAT_BACKENDS. SDK-level retries are disabled when there is
+    another backend to fail over to.
+    """
+    keys = [k.strip() for k in os.getenv("GROQ_API_KEYS", "").split(",") if k.strip()]
+    if not keys and os.getenv("GROQ_API_KEY"):
+        keys = [os.getenv("GROQ_API_KEY")]
+
+    compat = []
+    raw = os.getenv("OPENAI_COMPAT_BACKENDS")
+    if raw:
+        try:
+            compat = [c for c in json.loads(raw) if c.get("base_url")]
+        except (json.JSONDecodeError, AttributeError, TypeError) as e:
+            print(f"[UPSTREAM] ⚠ Ignoring invalid OPENAI_COMPAT_BACKENDS: {e}")
+
+    total = len(keys) + len(compat)
+    max_retries = 0 if total > 1 else 2
+
+    backends = [
+        # Only the key's last 4 chars go into the name (it shows up in /upstreams)
+        Backend(f"groq-{i}-{key[-4:]}", "groq", api_key=key, max_retries=max_retries)
+        for i, key in enumerate(keys)
+    ]
+    for i, cfg in enumerate(compat):
+        backends.append(Backend(
+            cfg.get("name") or f"openai-{i}",
+            "openai",
+            api_key=cfg.get("api_key"),
+            base_url=cfg["base_url"],
+            model=cfg.get("model", DEFAULT_MODEL)
+        ))
+
+    if not backends:
+        # Keep the old behaviour: the Groq SDK raises a clear error on first call
+        backends.append(Backend("groq-0", "groq", api_key=None))
+
+    print(f"[UPSTREAM] Pool ready: {', '.join(b.name for b in backends)}")
+    return UpstreamPool(backends)
@@ -1,7 +1,60 @@
 # Gunicorn configuration
+import gc
+import os
+
 bind = "0.0.0.0:10000"
 workers = 2
+# Threaded workers so one slow debate doesn't block a worker; the fair
+# scheduler in backend/scheduler.py decides whose upstream calls go first,
+# and its RequestLimiter keeps bulk debates (and any one client) to a share
+# of these threads. The app reads GUNICORN_THREADS too, so set it there.
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
 timeout = 120  # Allow 120 seconds for long-running requests
 keepalive = 5
 
+# Import the app once in the master and fork workers from it. Personas and
+# prompt templates are then shared copy-on-write; upstream clients are still
+# built lazily inside each worker (see get_upstream_pool in backend/app.py).
+preload_app = True
+
+# Seconds in-flight work gets to finish after SIGTERM (see begin_drain in
+# backend/app.py). The app counts them from SIGTERM itself and closes the
+# drain on a timer when they run out: stragglers are counted as aborted and
+# the executor and upstream clients are shut down, so they fail fast.
+# Gunicorn keeps waiting on open connections until graceful_timeout and
+# SIGKILLs then, so the extra seconds let that timer (and worker_exit, if
+# the stragglers end in time) run before the kill.
+drain_grace = int(os.getenv("DRAIN_GRACE_SECONDS", "25"))
+graceful_timeout = drain_grace + 5
+
+
+def when_ready(server):
+    # Move everything the preloaded app allocated into the permanent
+    # generation so the cyclic GC in workers never touches (and un-shares)
+    # those pages.
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    # Chain the app's drain onto gunicorn's own SIGTERM handler: readiness
+    # goes false, new work is refused and the drain grace period starts,
+    # then gunicorn stops accepting and lets the current request finish.
+    import signal
+    from app import begin_drain
+
+    gunicorn_handler = signal.getsignal(signal.SIGTERM)
+
+    def on_sigterm(signum, frame):
+        begin_drain()
+        gunicorn_handler(signum, frame)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+
 
+def worker_exit(server, worker):
+    # Requests are done by now; wait for background pipelines (cache
+    # warm-up), then shut down the executor and upstream HTTP clients. A
+    # no-op if the drain timer already did this.
+    from app import drain_and_shutdown
+    drain_and_shutdown()